@@ -5,311 +5,365 @@ from discord.ext import commands, tasks
 import asyncio
 import json
 import time
-import asyncpg
-from typing import Optional, Dict, Any
+import hashlib
+import logging
+import io
+import signal
+import functools
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, Set
+from storage import Storage, DatabaseBusyError, create_storage
 
 # ---------------------------------
-# ----- Configuration PostgreSQL -----
+# ----- Configuration du stockage -----
+# postgres://... pour PostgreSQL, sqlite:///tickets.db pour un fichier SQLite local
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-# Pool de connexions PostgreSQL
-db_pool = None
+# Backend de stockage (voir storage.py)
+storage: Optional[Storage] = None
 
 async def init_database():
-    """Initialiser la base de données PostgreSQL et créer les tables"""
-    global db_pool
+    """Initialiser le backend de stockage et créer les tables"""
+    global storage
     
     if not DATABASE_URL:
         raise ValueError("❌ DATABASE_URL manquant dans les variables d'environnement")
     
-    # Créer le pool de connexions
-    db_pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=10)
-    
-    # Créer les tables si elles n'existent pas
-    async with db_pool.acquire() as conn:
-        # Table pour la configuration des serveurs
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS servers_config (
-                guild_id BIGINT PRIMARY KEY,
-                category_name VARCHAR(255) DEFAULT 'TICKETS',
-                staff_role_id BIGINT,
-                ticket_message TEXT DEFAULT '{user} Merci d''avoir ouvert un ticket. Un membre du staff va te répondre.',
-                status_channel_id BIGINT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Table pour les messages avec boutons de tickets
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS ticket_messages (
-                message_id BIGINT,
-                guild_id BIGINT,
-                channel_id BIGINT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (message_id, guild_id)
-            )
-        ''')
-        
-        # Table pour les tickets ouverts
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS open_tickets (
-                user_id BIGINT,
-                guild_id BIGINT,
-                ticket_channel_id BIGINT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (user_id, guild_id)
-            )
-        ''')
-        
-        # Table pour les messages de fermeture
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS close_button_messages (
-                message_id BIGINT PRIMARY KEY,
-                channel_id BIGINT,
-                guild_id BIGINT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Table pour les messages de status
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS status_messages (
-                guild_id BIGINT PRIMARY KEY,
-                message_id BIGINT,
-                channel_id BIGINT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+    storage = create_storage(DATABASE_URL)
+    await storage.init()
     
-    print("✅ Base de données PostgreSQL initialisée")
+    print(f"✅ Base de données {storage.name} initialisée")
 
 # ----- Fonctions de gestion de la configuration des serveurs -----
 async def get_server_config(guild_id: int) -> Dict[str, Any]:
     """Obtenir la configuration d'un serveur spécifique"""
-    async with db_pool.acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT * FROM servers_config WHERE guild_id = $1", guild_id
-        )
-        
-        if row:
-            return {
-                "category_name": row["category_name"],
-                "staff_role_id": row["staff_role_id"],
-                "ticket_message": row["ticket_message"],
-                "status_channel_id": row["status_channel_id"]
-            }
-        else:
-            # Créer la configuration par défaut
-            default_config = {
-                "category_name": "TICKETS",
-                "staff_role_id": None,
-                "ticket_message": "{user} Merci d'avoir ouvert un ticket. Un membre du staff va te répondre.",
-                "status_channel_id": None
-            }
-            
-            await conn.execute('''
-                INSERT INTO servers_config (guild_id, category_name, staff_role_id, ticket_message, status_channel_id)
-                VALUES ($1, $2, $3, $4, $5)
-                ON CONFLICT (guild_id) DO NOTHING
-            ''', guild_id, default_config["category_name"], default_config["staff_role_id"], 
-                default_config["ticket_message"], default_config["status_channel_id"])
-            
-            return default_config
+    return await storage.get_server_config(guild_id)
 
 async def update_server_config(guild_id: int, updates: Dict[str, Any]):
     """Mettre à jour la configuration d'un serveur"""
-    async with db_pool.acquire() as conn:
-        # Vérifier si la configuration existe
-        exists = await conn.fetchval(
-            "SELECT EXISTS(SELECT 1 FROM servers_config WHERE guild_id = $1)", guild_id
-        )
-        
-        if not exists:
-            # Créer la configuration par défaut
-            await conn.execute('''
-                INSERT INTO servers_config (guild_id, category_name, staff_role_id, ticket_message, status_channel_id)
-                VALUES ($1, 'TICKETS', NULL, $2, NULL)
-            ''', guild_id, '{user} Merci d\'avoir ouvert un ticket. Un membre du staff va te répondre.')
-        
-        # Mettre à jour les champs spécifiés
-        for key, value in updates.items():
-            if key in ["category_name", "staff_role_id", "ticket_message", "status_channel_id"]:
-                await conn.execute(f'''
-                    UPDATE servers_config 
-                    SET {key} = $1 
-                    WHERE guild_id = $2
-                ''', value, guild_id)
+    await storage.update_server_config(guild_id, updates)
+
+async def list_status_channels() -> List[Dict[str, int]]:
+    """Lister les serveurs ayant un salon de status configuré"""
+    return await storage.list_status_channels()
 
 # ----- Fonctions de gestion des messages de tickets -----
 async def add_ticket_message(guild_id: int, message_id: int, channel_id: int):
     """Ajouter un message de ticket pour un serveur"""
-    async with db_pool.acquire() as conn:
-        await conn.execute('''
-            INSERT INTO ticket_messages (message_id, guild_id, channel_id)
-            VALUES ($1, $2, $3)
-            ON CONFLICT (message_id, guild_id) DO UPDATE SET channel_id = $3
-        ''', message_id, guild_id, channel_id)
+    await storage.add_ticket_message(guild_id, message_id, channel_id)
 
 async def remove_ticket_message(guild_id: int, message_id: int):
     """Supprimer un message de ticket pour un serveur"""
-    async with db_pool.acquire() as conn:
-        await conn.execute('''
-            DELETE FROM ticket_messages 
-            WHERE guild_id = $1 AND message_id = $2
-        ''', guild_id, message_id)
+    await storage.remove_ticket_message(guild_id, message_id)
 
 async def load_ticket_messages() -> Dict[int, Dict[int, int]]:
     """Charger tous les messages de tickets"""
-    async with db_pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM ticket_messages")
-        
-        result = {}
-        for row in rows:
-            guild_id = row["guild_id"]
-            message_id = row["message_id"]
-            channel_id = row["channel_id"]
-            
-            if guild_id not in result:
-                result[guild_id] = {}
-            result[guild_id][message_id] = channel_id
-        
-        return result
+    return await storage.load_ticket_messages()
 
 # ----- Fonctions de gestion des tickets ouverts -----
-async def save_open_ticket(user_id: int, channel_id: int, guild_id: int):
-    """Sauvegarder un ticket ouvert"""
-    async with db_pool.acquire() as conn:
-        await conn.execute('''
-            INSERT INTO open_tickets (user_id, guild_id, ticket_channel_id)
-            VALUES ($1, $2, $3)
-            ON CONFLICT (user_id, guild_id) 
-            DO UPDATE SET ticket_channel_id = $3, created_at = CURRENT_TIMESTAMP
-        ''', user_id, guild_id, channel_id)
+async def remove_open_ticket(user_id: int, guild_id: int):
+    """Supprimer un ticket ouvert"""
+    if await storage.remove_open_ticket(user_id, guild_id):
+        print(f"Ticket supprimé de la DB: utilisateur {user_id} sur serveur {guild_id}")
+    else:
+        print(f"Ticket non trouvé dans la DB: utilisateur {user_id} sur serveur {guild_id}")
+
+async def record_ticket_opened(user_id: int, channel_id: int, guild_id: int, close_message_id: int):
+    """Enregistrer l'ouverture d'un ticket et son bouton de fermeture en une seule transaction"""
+    await storage.record_ticket_opened(user_id, channel_id, guild_id, close_message_id, int(time.time()))
     
     print(f"Ticket sauvegardé: utilisateur {user_id} sur serveur {guild_id} -> salon {channel_id}")
 
-async def remove_open_ticket(user_id: int, guild_id: int):
-    """Supprimer un ticket ouvert"""
-    async with db_pool.acquire() as conn:
-        result = await conn.execute('''
-            DELETE FROM open_tickets 
-            WHERE user_id = $1 AND guild_id = $2
-        ''', user_id, guild_id)
-        
-        if result == "DELETE 1":
-            print(f"Ticket supprimé de la DB: utilisateur {user_id} sur serveur {guild_id}")
-        else:
-            print(f"Ticket non trouvé dans la DB: utilisateur {user_id} sur serveur {guild_id}")
+async def record_ticket_closed(channel_id: int) -> Dict[str, Any]:
+    """Supprimer le ticket et ses boutons de fermeture pour un salon, en une seule transaction"""
+    return await storage.record_ticket_closed(channel_id)
+
+async def save_ticket_activity(activity: Dict[int, int]):
+    """Écrire en une requête les derniers horodatages d'activité (salon -> timestamp)"""
+    if not activity:
+        return
+    await storage.save_ticket_activity(activity)
 
-async def user_has_open_ticket(user_id: int, guild_id: int) -> bool:
-    """Vérifier si l'utilisateur a déjà un ticket ouvert sur ce serveur"""
-    async with db_pool.acquire() as conn:
-        return await conn.fetchval('''
-            SELECT EXISTS(SELECT 1 FROM open_tickets WHERE user_id = $1 AND guild_id = $2)
-        ''', user_id, guild_id)
+async def find_inactive_tickets(now: int, limit: int) -> List[Dict[str, int]]:
+    """Trouver les tickets dont l'inactivité dépasse le délai configuré par leur serveur"""
+    return await storage.find_inactive_tickets(now, limit)
 
 async def get_user_open_ticket(user_id: int, guild_id: int) -> Optional[int]:
     """Obtenir le channel ID du ticket ouvert de l'utilisateur sur ce serveur"""
-    async with db_pool.acquire() as conn:
-        return await conn.fetchval('''
-            SELECT ticket_channel_id FROM open_tickets 
-            WHERE user_id = $1 AND guild_id = $2
-        ''', user_id, guild_id)
+    return await storage.get_user_open_ticket(user_id, guild_id)
 
 async def load_open_tickets() -> Dict[str, Dict[str, Any]]:
     """Charger tous les tickets ouverts"""
-    async with db_pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM open_tickets")
-        
-        result = {}
-        for row in rows:
-            key = f"{row['user_id']}_{row['guild_id']}"
-            result[key] = {
-                "user_id": row["user_id"],
-                "guild_id": row["guild_id"],
-                "ticket_channel_id": row["ticket_channel_id"],
-                "created_at": int(row["created_at"].timestamp())
-            }
-        
-        return result
+    return await storage.load_open_tickets()
 
-# ----- Fonctions de gestion des boutons de fermeture -----
-async def save_close_button_message(message_id: int, channel_id: int, guild_id: int):
-    """Sauvegarder un message avec bouton de fermeture"""
-    async with db_pool.acquire() as conn:
-        await conn.execute('''
-            INSERT INTO close_button_messages (message_id, channel_id, guild_id)
-            VALUES ($1, $2, $3)
-            ON CONFLICT (message_id) 
-            DO UPDATE SET channel_id = $2, guild_id = $3
-        ''', message_id, channel_id, guild_id)
+async def load_guild_open_tickets(guild_id: int) -> List[Dict[str, int]]:
+    """Charger les tickets ouverts d'un serveur"""
+    return await storage.load_guild_open_tickets(guild_id)
 
+# ----- Fonctions de gestion des boutons de fermeture -----
 async def load_close_button_messages() -> Dict[int, Dict[str, int]]:
     """Charger tous les messages avec boutons de fermeture"""
-    async with db_pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM close_button_messages")
-        
-        result = {}
-        for row in rows:
-            result[row["message_id"]] = {
-                "channel_id": row["channel_id"],
-                "guild_id": row["guild_id"]
-            }
-        
-        return result
-
-async def remove_close_button_message(message_id: int):
-    """Supprimer un message avec bouton de fermeture"""
-    async with db_pool.acquire() as conn:
-        await conn.execute('''
-            DELETE FROM close_button_messages WHERE message_id = $1
-        ''', message_id)
+    return await storage.load_close_button_messages()
 
 # ----- Fonctions de gestion des messages de status -----
 async def save_status_message(guild_id: int, message_id: int, channel_id: int):
     """Sauvegarder un message de status"""
-    async with db_pool.acquire() as conn:
-        await conn.execute('''
-            INSERT INTO status_messages (guild_id, message_id, channel_id)
-            VALUES ($1, $2, $3)
-            ON CONFLICT (guild_id) 
-            DO UPDATE SET message_id = $2, channel_id = $3
-        ''', guild_id, message_id, channel_id)
+    await storage.save_status_message(guild_id, message_id, channel_id)
 
 async def load_status_messages() -> Dict[int, Dict[str, int]]:
     """Charger tous les messages de status"""
-    async with db_pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM status_messages")
-        
-        result = {}
-        for row in rows:
-            result[row["guild_id"]] = {
-                "message_id": row["message_id"],
-                "channel_id": row["channel_id"]
-            }
-        
-        return result
+    return await storage.load_status_messages()
 
 async def remove_status_message(guild_id: int):
     """Supprimer un message de status"""
-    async with db_pool.acquire() as conn:
-        await conn.execute('''
-            DELETE FROM status_messages WHERE guild_id = $1
-        ''', guild_id)
+    await storage.remove_status_message(guild_id)
 
 # ---------------------------------
 # ----- Bot Discord -----
+# Profil de cache: "default" (cache discord.py standard) ou "low_memory"
+CACHE_PROFILE = os.getenv("CACHE_PROFILE", "default")
+
 intents = discord.Intents.default()
 intents.guilds = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+cache_options = {}
+if CACHE_PROFILE == "low_memory":
+    # Le bot n'utilise que les serveurs, salons, rôles, interactions et les messages
+    # des salons de tickets (activité): tout le reste est désactivé
+    intents.emojis_and_stickers = False
+    intents.integrations = False
+    intents.webhooks = False
+    intents.invites = False
+    intents.voice_states = False
+    intents.reactions = False
+    intents.typing = False
+    intents.dm_messages = False
+    intents.guild_scheduled_events = False
+    intents.auto_moderation = False
+    cache_options = {
+        "max_messages": None,
+        "member_cache_flags": discord.MemberCacheFlags.none(),
+        "chunk_guilds_at_startup": False
+    }
+
+class TicketCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # Refuser les nouvelles commandes pendant l'arrêt progressif
+        if draining:
+            await send_draining_message(interaction)
+            return False
+        return True
+
+# Au-delà de ce délai, discord.py lève RateLimited au lieu d'attendre (minimum imposé: 30s)
+REST_MAX_RATELIMIT_TIMEOUT = float(os.getenv("REST_MAX_RATELIMIT_TIMEOUT", "30"))
+bot = commands.Bot(
+    command_prefix="!",
+    intents=intents,
+    tree_cls=TicketCommandTree,
+    max_ratelimit_timeout=REST_MAX_RATELIMIT_TIMEOUT,
+    **cache_options
+)
 tree = bot.tree
 
+def current_rss_bytes() -> Optional[int]:
+    """Mémoire résidente actuelle du processus (Linux uniquement)"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def log_memory_usage():
+    """Afficher la mémoire résidente totale et par serveur"""
+    rss = current_rss_bytes()
+    if rss is None:
+        return
+    guild_count = max(1, len(bot.guilds))
+    print(f"Mémoire (profil {CACHE_PROFILE}): {rss / 1024 / 1024:.1f} Mo RSS, "
+          f"~{rss / guild_count / 1024:.1f} Ko par serveur ({len(bot.guilds)} serveur(s))")
+
 # Variables globales
 ticket_messages = {}
 open_tickets = {}
 close_button_messages = {}
 status_messages = {}
 
+# Statistiques par serveur et serveurs dont les statistiques restent à écrire
+ticket_stats = {}
+dirty_stats = set()
+# Serveurs dont les statistiques ont été créées en mémoire sans lire la DB
+# (ligne éventuellement importée depuis le démarrage: fusionnée avant la première écriture)
+unmerged_stats = set()
+
+# Salons de tickets connus et dernière activité non encore écrite en DB (salon -> timestamp)
+ticket_channel_ids = set()
+ticket_activity: Dict[int, int] = {}
+
+# ----- Planificateur des requêtes REST Discord -----
+PRIORITY_INTERACTION = 0
+PRIORITY_MAINTENANCE = 1
+
+# Nombre maximal de tentatives pour un appel de maintenance qui reçoit un 429
+REST_MAX_RETRIES = int(os.getenv("REST_MAX_RETRIES", "3"))
+
+class RouteRateLimited(Exception):
+    """Levée quand une route est limitée par Discord: une interaction doit échouer vite"""
+
+    def __init__(self, route: str, retry_after: float):
+        super().__init__(f"Route {route} limitée par Discord pendant {retry_after:.2f}s")
+        self.route = route
+        self.retry_after = retry_after
+
+class RestScheduler:
+    """Faire passer tous les appels REST Discord par un point unique.
+
+    Chaque appel est associé à une route (le paramètre majeur du bucket Discord:
+    salon ou serveur). Les appels d'une même route sont sérialisés et respectent
+    le délai imposé par le dernier 429 reçu sur cette route; l'état d'une route
+    est oublié dès qu'elle n'a plus d'appel en cours ni de délai actif.
+    Les appels d'interaction passent avant la maintenance: une tâche de fond attend
+    qu'aucune interaction ne soit en cours et qu'aucune pause ne soit active.
+    Un appel d'interaction sur une route déjà bloquée par un 429 lève aussitôt
+    RouteRateLimited et l'utilisateur est invité à réessayer. Les 429 plus courts que
+    max_ratelimit_timeout (30s minimum) restent attendus par discord.py dans l'appel:
+    une interaction qui enchaîne plusieurs appels REST doit donc être différée (defer).
+    """
+
+    def __init__(self):
+        self._buckets: Dict[str, Dict[str, Any]] = {}
+        self._interactions_pending = 0
+        self._interactions_idle = asyncio.Event()
+        self._interactions_idle.set()
+        self._maintenance_paused_until = 0.0
+        self.rate_limit_hits = 0
+
+    def _acquire_bucket(self, route: str) -> Dict[str, Any]:
+        bucket = self._buckets.get(route)
+        if bucket is None:
+            bucket = {"lock": asyncio.Lock(), "blocked_until": 0.0, "users": 0}
+            self._buckets[route] = bucket
+        bucket["users"] += 1
+        return bucket
+
+    def _release_bucket(self, route: str, bucket: Dict[str, Any]):
+        bucket["users"] -= 1
+        if bucket["users"] == 0 and bucket["blocked_until"] <= time.monotonic():
+            self._buckets.pop(route, None)
+
+    def _prune_buckets(self):
+        """Oublier les routes sans appel en cours dont le délai est écoulé"""
+        now = time.monotonic()
+        for route, bucket in list(self._buckets.items()):
+            if bucket["users"] == 0 and bucket["blocked_until"] <= now:
+                del self._buckets[route]
+
+    def pause_maintenance(self, retry_after: float):
+        """Suspendre la maintenance suite à un 429, quelle que soit sa route"""
+        self._maintenance_paused_until = max(
+            self._maintenance_paused_until, time.monotonic() + retry_after
+        )
+
+    def record_rate_limit(self, retry_after: float, route: Optional[str] = None):
+        """Enregistrer un 429 et bloquer la route concernée"""
+        self.rate_limit_hits += 1
+        self.pause_maintenance(retry_after)
+        self._prune_buckets()
+        bucket = self._buckets.get(route) if route is not None else None
+        if bucket is not None:
+            bucket["blocked_until"] = max(bucket["blocked_until"], time.monotonic() + retry_after)
+        print(f"Rate limit Discord sur {route or 'route inconnue'}: maintenance en pause {retry_after:.2f}s")
+
+    async def _wait_for_maintenance_slot(self):
+        while True:
+            await self._interactions_idle.wait()
+            delay = self._maintenance_paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def _invoke(self, route: str, factory):
+        try:
+            return await factory()
+        except discord.RateLimited as e:
+            retry_after = e.retry_after
+            error = e
+        except discord.HTTPException as e:
+            if e.status != 429:
+                raise
+            retry_after = float(e.response.headers.get("Retry-After", 1))
+            error = e
+        self.record_rate_limit(retry_after, route)
+        raise RouteRateLimited(route, retry_after) from error
+
+    async def _attempt(self, route: str, factory, interactive: bool):
+        # Un jeton d'interaction ne sert qu'une fois: rien à sérialiser ni à retenir
+        if route.startswith("interaction:"):
+            return await self._invoke(route, factory)
+
+        bucket = self._acquire_bucket(route)
+        try:
+            while True:
+                delay = bucket["blocked_until"] - time.monotonic()
+                if delay > 0:
+                    if interactive:
+                        raise RouteRateLimited(route, delay)
+                    # Attendre hors du verrou pour ne pas bloquer les interactions de la route
+                    await asyncio.sleep(delay)
+                    continue
+                async with bucket["lock"]:
+                    # Un 429 a pu arriver pendant l'attente du verrou
+                    if bucket["blocked_until"] > time.monotonic():
+                        continue
+                    return await self._invoke(route, factory)
+        finally:
+            self._release_bucket(route, bucket)
+
+    async def call(self, route: str, factory, priority: int = PRIORITY_MAINTENANCE):
+        """Exécuter `factory()` (qui renvoie une coroutine) sur la route donnée"""
+        interactive = priority == PRIORITY_INTERACTION
+        if interactive:
+            self._interactions_pending += 1
+            self._interactions_idle.clear()
+        try:
+            attempt = 0
+            while True:
+                if not interactive:
+                    await self._wait_for_maintenance_slot()
+                try:
+                    return await self._attempt(route, factory, interactive)
+                except RouteRateLimited:
+                    attempt += 1
+                    if interactive or attempt >= REST_MAX_RETRIES:
+                        raise
+        finally:
+            if interactive:
+                self._interactions_pending -= 1
+                if self._interactions_pending == 0:
+                    self._interactions_idle.set()
+
+    async def interaction(self, route: str, factory):
+        return await self.call(route, factory, PRIORITY_INTERACTION)
+
+    async def maintenance(self, route: str, factory):
+        return await self.call(route, factory, PRIORITY_MAINTENANCE)
+
+rest = RestScheduler()
+
+class RateLimitLogHandler(logging.Handler):
+    """Détecter les 429 gérés en interne par discord.py (journal `discord.http`)"""
+
+    def emit(self, record: logging.LogRecord):
+        message = record.getMessage()
+        if "429" not in message and "rate limit" not in message.lower():
+            return
+        # Suivi d'un RateLimited levé vers l'appelant, déjà compté par RestScheduler
+        if "erroring instead" in message:
+            return
+        if record.args and isinstance(record.args[-1], (int, float)):
+            rest.record_rate_limit(float(record.args[-1]))
+
+logging.getLogger("discord.http").addHandler(RateLimitLogHandler(level=logging.WARNING))
+
 # ----- Fonction de nettoyage immédiat -----
 async def force_clean_guild_tickets(guild_id: int):
     """Nettoyer immédiatement les tickets inexistants pour un serveur"""
@@ -319,123 +373,308 @@ async def force_clean_guild_tickets(guild_id: int):
         return
     
     to_remove = []
-    async with db_pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM open_tickets WHERE guild_id = $1", guild_id)
+    for row in await load_guild_open_tickets(guild_id):
+        channel_id = row["ticket_channel_id"]
+        user_id = row["user_id"]
+        channel = guild.get_channel(channel_id)
         
-        for row in rows:
-            channel_id = row["ticket_channel_id"]
-            user_id = row["user_id"]
-            channel = guild.get_channel(channel_id)
-            
-            if not channel:
-                await remove_open_ticket(user_id, guild_id)
-                key = f"{user_id}_{guild_id}"
-                to_remove.append(key)
-                print(f"Nettoyage immédiat: ticket {key} supprimé")
+        if not channel:
+            await remove_open_ticket(user_id, guild_id)
+            key = f"{user_id}_{guild_id}"
+            to_remove.append(key)
+            print(f"Nettoyage immédiat: ticket {key} supprimé")
     
     for key in to_remove:
         open_tickets.pop(key, None)
     
     print(f"Nettoyage immédiat terminé pour le serveur {guild.name}: {len(to_remove)} ticket(s) nettoyé(s)")
 
-# ----- Vue bouton ticket -----
-class TicketButton(discord.ui.View):
+# ----- Réponses aux interactions -----
+async def respond(interaction: discord.Interaction, *args, **kwargs):
+    """Répondre à l'interaction, ou envoyer un suivi si elle a déjà reçu sa réponse"""
+    if interaction.response.is_done():
+        send = interaction.followup.send
+    else:
+        send = interaction.response.send_message
+    return await rest.interaction(f"interaction:{interaction.id}", lambda: send(*args, **kwargs))
+
+# ----- Gestion de la saturation de la base de données -----
+BUSY_MESSAGE = "⏳ Le bot est très sollicité en ce moment, réessaie dans quelques secondes."
+
+async def send_busy_message(interaction: discord.Interaction):
+    """Répondre à l'utilisateur que la base de données (ou Discord) est saturée"""
+    await respond(interaction, BUSY_MESSAGE, ephemeral=True)
+
+# ----- Suivi des traitements en cours (arrêt progressif) -----
+DRAINING_MESSAGE = "🔧 Le bot redémarre, réessaie dans quelques instants."
+
+# Passe à True à l'arrêt: plus aucune nouvelle interaction n'est acceptée
+draining = False
+inflight_count = 0
+inflight_idle = asyncio.Event()
+inflight_idle.set()
+
+@asynccontextmanager
+async def track_inflight():
+    """Compter un traitement en cours pour que l'arrêt attende sa fin"""
+    global inflight_count
+    inflight_count += 1
+    inflight_idle.clear()
+    try:
+        yield
+    finally:
+        inflight_count -= 1
+        if inflight_count == 0:
+            inflight_idle.set()
+
+def tracked_inflight(func):
+    """Décorateur: l'arrêt progressif attend la fin de chaque appel de `func`"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        async with track_inflight():
+            return await func(*args, **kwargs)
+    return wrapper
+
+def loop_iteration(func):
+    """Décorateur des tâches périodiques: aucune itération ne démarre pendant l'arrêt,
+    et l'itération en cours est comptée pour que l'arrêt attende sa fin"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if draining:
+            return
+        async with track_inflight():
+            return await func(*args, **kwargs)
+    return wrapper
+
+async def send_draining_message(interaction: discord.Interaction):
+    """Répondre à l'utilisateur que le bot est en cours d'arrêt"""
+    await respond(interaction, DRAINING_MESSAGE, ephemeral=True)
+
+class PersistentView(discord.ui.View):
+    """Vue sans expiration qui transforme la saturation du pool en message clair"""
+
     def __init__(self):
         super().__init__(timeout=None)
 
-    @discord.ui.button(label="Ouvrir un ticket", style=discord.ButtonStyle.green)
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if draining:
+            await send_draining_message(interaction)
+            return False
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: Exception, item: discord.ui.Item):
+        if isinstance(error, DatabaseBusyError):
+            print(f"Interaction refusée (base saturée): {error}")
+            return await send_busy_message(interaction)
+        if isinstance(error, RouteRateLimited):
+            print(f"Interaction refusée (rate limit Discord): {error}")
+            return await send_busy_message(interaction)
+        await super().on_error(interaction, error, item)
+
+@tree.error
+async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    original = getattr(error, "original", error)
+    if isinstance(original, DatabaseBusyError):
+        print(f"Commande refusée (base saturée): {original}")
+        return await send_busy_message(interaction)
+    if isinstance(original, RouteRateLimited):
+        print(f"Commande refusée (rate limit Discord): {original}")
+        return await send_busy_message(interaction)
+    command_name = interaction.command.name if interaction.command else "inconnue"
+    print(f"Erreur lors de l'exécution de la commande /{command_name}: {original}")
+
+# ----- Limitation du débit de création de tickets -----
+# Capacité (rafale) et recharge par minute des seaux par serveur et par utilisateur
+TICKET_RATE_GUILD_CAPACITY = float(os.getenv("TICKET_RATE_GUILD_CAPACITY", "10"))
+TICKET_RATE_GUILD_PER_MINUTE = float(os.getenv("TICKET_RATE_GUILD_PER_MINUTE", "5"))
+TICKET_RATE_USER_CAPACITY = float(os.getenv("TICKET_RATE_USER_CAPACITY", "2"))
+TICKET_RATE_USER_PER_MINUTE = float(os.getenv("TICKET_RATE_USER_PER_MINUTE", "1"))
+# Au-delà de ce nombre de seaux, les seaux pleins (inactifs) sont oubliés
+TICKET_RATE_MAX_BUCKETS = int(os.getenv("TICKET_RATE_MAX_BUCKETS", "10000"))
+
+class TokenBucket:
+    """Seau à jetons: `capacity` jetons au maximum, rechargés à `per_minute` par minute"""
+
+    def __init__(self, capacity: float, per_minute: float):
+        self.capacity = capacity
+        self.rate = per_minute / 60
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self) -> bool:
+        return self.tokens >= self.capacity
+
+class TicketRateLimiter:
+    """Limiter les ouvertures de tickets par serveur et par utilisateur, en mémoire"""
+
+    def __init__(self):
+        self._guild_buckets: Dict[int, TokenBucket] = {}
+        self._user_buckets: Dict[tuple, TokenBucket] = {}
+        self.guild_hits = 0
+        self.user_hits = 0
+        self._logged_hits = (0, 0)
+
+    def _get(self, buckets: Dict, key, capacity: float, per_minute: float, now: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= TICKET_RATE_MAX_BUCKETS:
+                self._prune(buckets, now)
+            bucket = TokenBucket(capacity, per_minute)
+            buckets[key] = bucket
+        else:
+            bucket.refill(now)
+        return bucket
+
+    @staticmethod
+    def _prune(buckets: Dict, now: float):
+        for key, bucket in list(buckets.items()):
+            bucket.refill(now)
+            if bucket.is_full():
+                del buckets[key]
+
+    def check(self, guild_id: int, user_id: int) -> Optional[str]:
+        """Consommer un jeton de chaque seau, ou renvoyer la portée ("user"/"guild") de la limite atteinte"""
+        now = time.monotonic()
+        user_bucket = self._get(self._user_buckets, (guild_id, user_id),
+                                TICKET_RATE_USER_CAPACITY, TICKET_RATE_USER_PER_MINUTE, now)
+        guild_bucket = self._get(self._guild_buckets, guild_id,
+                                 TICKET_RATE_GUILD_CAPACITY, TICKET_RATE_GUILD_PER_MINUTE, now)
+
+        # Vérifier l'utilisateur d'abord pour qu'un spammeur ne vide pas le seau du serveur
+        if user_bucket.tokens < 1:
+            self.user_hits += 1
+            return "user"
+        if guild_bucket.tokens < 1:
+            self.guild_hits += 1
+            return "guild"
+        user_bucket.tokens -= 1
+        guild_bucket.tokens -= 1
+        return None
+
+    def log_hits(self):
+        """Afficher les compteurs globaux s'ils ont changé depuis le dernier affichage"""
+        hits = (self.user_hits, self.guild_hits)
+        if hits == self._logged_hits:
+            return
+        self._logged_hits = hits
+        print(f"🚦 Créations de tickets limitées depuis le démarrage: {self.user_hits} par utilisateur, "
+              f"{self.guild_hits} par serveur ({len(self._user_buckets)} seau(x) utilisateur, "
+              f"{len(self._guild_buckets)} seau(x) serveur)")
+
+ticket_rate_limiter = TicketRateLimiter()
+
+# ----- Vue bouton ticket -----
+class TicketButton(PersistentView):
+    @discord.ui.button(label="Ouvrir un ticket", style=discord.ButtonStyle.green, custom_id="ticket:open")
+    @tracked_inflight
     async def open_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
         user_id = interaction.user.id
         guild_id = interaction.guild.id
         
-        # Vérifier si l'utilisateur a déjà un ticket ouvert sur ce serveur
-        if await user_has_open_ticket(user_id, guild_id):
-            existing_channel_id = await get_user_open_ticket(user_id, guild_id)
+        # Limiter le débit en mémoire avant tout accès DB ou REST
+        limited = ticket_rate_limiter.check(guild_id, user_id)
+        if limited:
+            print(f"Création de ticket limitée ({limited}): utilisateur {user_id} sur serveur {guild_id}")
+            record_stats_rate_limited(guild_id)
+            if limited == "user":
+                message = "⏳ Tu ouvres des tickets trop vite, réessaie dans une minute."
+            else:
+                message = "⏳ Trop de tickets sont ouverts sur ce serveur en ce moment, réessaie dans quelques minutes."
+            return await respond(interaction, message, ephemeral=True)
+        
+        # Différer la réponse: la création du salon peut attendre un 429 ou d'autres
+        # créations du même serveur au-delà des 3s accordées par Discord
+        await rest.interaction(f"interaction:{interaction.id}", lambda: interaction.response.defer(
+            ephemeral=True, thinking=True
+        ))
+        
+        # Vérifier si l'utilisateur a déjà un ticket ouvert sur ce serveur (une seule requête)
+        existing_channel_id = await get_user_open_ticket(user_id, guild_id)
+        if existing_channel_id is not None:
             print(f"Tentative d'ouverture de ticket bloquée: utilisateur {user_id} a déjà le ticket {existing_channel_id} sur serveur {guild_id}")
-            await interaction.response.send_message(
-                f"❌ Tu as déjà un ticket ouvert <#{existing_channel_id}> sur ce serveur ! Ferme ton ticket actuel avant d'en créer un nouveau.", 
+            await respond(
+                interaction,
+                f"❌ Tu as déjà un ticket ouvert <#{existing_channel_id}> sur ce serveur ! Ferme ton ticket actuel avant d'en créer un nouveau.",
                 ephemeral=True
             )
             return
 
         print(f"Création de ticket autorisée pour utilisateur {user_id} sur serveur {guild_id}")
         channel = await create_ticket(interaction.user, interaction.guild)
-        await save_open_ticket(user_id, channel.id, guild_id)
         print(f"Ticket créé avec succès: salon {channel.id} pour utilisateur {user_id}")
-        await interaction.response.send_message(f"🎫 Ticket créé ! <#{channel.id}>", ephemeral=True)
+        await respond(interaction, f"🎫 Ticket créé ! <#{channel.id}>", ephemeral=True)
 
 # ----- Vue bouton fermeture ticket -----
-class CloseTicketButton(discord.ui.View):
-    def __init__(self):
-        super().__init__(timeout=None)
-
-    @discord.ui.button(label="🗑️ Fermer le ticket", style=discord.ButtonStyle.red)
+class CloseTicketButton(PersistentView):
+    @discord.ui.button(label="🗑️ Fermer le ticket", style=discord.ButtonStyle.red, custom_id="ticket:close")
+    @tracked_inflight
     async def close_ticket_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         guild = interaction.guild
         if not guild:
-            return await interaction.response.send_message(
-                "Erreur: Impossible d'accéder au serveur.", ephemeral=True
-            )
+            return await respond(interaction, "Erreur: Impossible d'accéder au serveur.", ephemeral=True)
 
         # Obtenir la configuration du serveur
         server_config = await get_server_config(guild.id)
         staff_role_id = server_config.get("staff_role_id")
 
-        # Vérifier les permissions staff
+        # Vérifier les permissions staff (rôles fournis par l'interaction, sans cache des membres)
         if staff_role_id:
             role = guild.get_role(staff_role_id)
-            member = guild.get_member(interaction.user.id)
-            if role and member and role not in member.roles:
-                return await interaction.response.send_message(
-                    "❌ Seul le staff peut fermer les tickets.", ephemeral=True
-                )
-
-        await interaction.response.send_message(
-            "🗑️ Fermeture du ticket dans 5 secondes..."
-        )
+            if role and role not in getattr(interaction.user, "roles", []):
+                return await respond(interaction, "❌ Seul le staff peut fermer les tickets.", ephemeral=True)
+
+        await respond(interaction, "🗑️ Fermeture du ticket dans 5 secondes...")
         
-        # Sauvegarder les IDs avant suppression
+        # Sauvegarder l'ID avant suppression
         channel_id_to_remove = interaction.channel.id
-        guild_id_to_clean = interaction.guild.id
         
         await asyncio.sleep(5)
 
-        # Supprimer de la liste des tickets ouverts
-        global open_tickets
-        async with db_pool.acquire() as conn:
-            row = await conn.fetchrow('''
-                SELECT user_id, guild_id FROM open_tickets 
-                WHERE ticket_channel_id = $1
-            ''', channel_id_to_remove)
-            
-            if row:
-                user_id = row["user_id"]
-                guild_id = row["guild_id"]
-                await remove_open_ticket(user_id, guild_id)
-                key = f"{user_id}_{guild_id}"
-                open_tickets.pop(key, None)
-                print(f"Ticket fermé: utilisateur {user_id} sur serveur {guild_id}")
-
-        # Supprimer le message du JSON des boutons de fermeture  
-        for msg_id, data in list(close_button_messages.items()):
-            if data["channel_id"] == channel_id_to_remove:
-                await remove_close_button_message(msg_id)
-                close_button_messages.pop(int(msg_id), None)
-                print(f"Bouton de fermeture supprimé pour le message {msg_id}")
-                break
+        await close_ticket(channel_id_to_remove, "Ticket fermé par le staff", PRIORITY_INTERACTION)
 
-        # Vérifier que le channel existe encore avant de le supprimer
-        try:
-            channel_to_delete = bot.get_channel(channel_id_to_remove)
-            if channel_to_delete:
-                await channel_to_delete.delete(reason="Ticket fermé par le staff")
-                print(f"Salon {channel_id_to_remove} supprimé avec succès")
-            else:
-                print(f"Salon {channel_id_to_remove} déjà supprimé ou introuvable")
-        except discord.NotFound:
-            print(f"Channel {channel_id_to_remove} déjà supprimé")
-        except Exception as e:
-            print(f"Erreur lors de la suppression du channel: {e}")
+# ----- Fermeture d'un ticket -----
+@tracked_inflight
+async def close_ticket(channel_id: int, reason: str, priority: int):
+    """Supprimer un ticket de la DB et de la mémoire, puis supprimer son salon"""
+    global open_tickets
+    
+    # Supprimer le ticket et ses boutons de fermeture en une seule transaction
+    closed = await record_ticket_closed(channel_id)
+    if closed["user_id"] is not None:
+        user_id = closed["user_id"]
+        guild_id = closed["guild_id"]
+        key = f"{user_id}_{guild_id}"
+        open_tickets.pop(key, None)
+        record_stats_close(guild_id, closed["created_at"])
+        print(f"Ticket fermé: utilisateur {user_id} sur serveur {guild_id}")
+
+    for msg_id in closed["close_message_ids"]:
+        close_button_messages.pop(msg_id, None)
+        print(f"Bouton de fermeture supprimé pour le message {msg_id}")
+
+    ticket_channel_ids.discard(channel_id)
+    ticket_activity.pop(channel_id, None)
+
+    # Vérifier que le channel existe encore avant de le supprimer
+    try:
+        channel_to_delete = bot.get_channel(channel_id)
+        if channel_to_delete:
+            try:
+                await rest.call(f"channel:{channel_id}", lambda: channel_to_delete.delete(reason=reason), priority)
+            except RouteRateLimited:
+                # L'interaction a déjà sa réponse: la suppression peut attendre la fin de la limite
+                await rest.maintenance(f"channel:{channel_id}", lambda: channel_to_delete.delete(reason=reason))
+            print(f"Salon {channel_id} supprimé avec succès")
+        else:
+            print(f"Salon {channel_id} déjà supprimé ou introuvable")
+    except discord.NotFound:
+        print(f"Channel {channel_id} déjà supprimé")
+    except Exception as e:
+        print(f"Erreur lors de la suppression du channel: {e}")
 
 # ----- Création ticket -----
 async def create_ticket(user, guild):
@@ -446,7 +685,7 @@ async def create_ticket(user, guild):
 
     category = discord.utils.get(guild.categories, name=category_name)
     if category is None:
-        category = await guild.create_category(category_name, reason="Catégorie tickets")
+        category = await rest.interaction(f"guild:{guild.id}", lambda: guild.create_category(category_name, reason="Catégorie tickets"))
 
     overwrites = {
         guild.default_role: discord.PermissionOverwrite(read_messages=False),
@@ -458,31 +697,287 @@ async def create_ticket(user, guild):
         if role:
             overwrites[role] = discord.PermissionOverwrite(read_messages=True, send_messages=True)
 
-    channel = await guild.create_text_channel(
+    channel = await rest.interaction(f"guild:{guild.id}", lambda: guild.create_text_channel(
         name=f"ticket-{user.name}",
         category=category,
         overwrites=overwrites,
         reason="Ticket créé"
-    )
+    ))
 
-    # Utiliser le message personnalisé du serveur
-    message = ticket_message.replace("{user}", user.mention)
-    msg = await channel.send(message, view=CloseTicketButton())
+    try:
+        # Utiliser le message personnalisé du serveur
+        message = ticket_message.replace("{user}", user.mention)
+        msg = await rest.interaction(f"channel:{channel.id}", lambda: channel.send(message, view=CloseTicketButton()))
+        
+        # Sauvegarder le ticket et le message avec bouton de fermeture en une transaction
+        await record_ticket_opened(user.id, channel.id, guild.id, msg.id)
+    except Exception:
+        # Compensation: ne pas laisser de salon orphelin si l'ouverture échoue à mi-chemin
+        try:
+            try:
+                await rest.interaction(f"channel:{channel.id}", lambda: channel.delete(reason="Échec de la création du ticket"))
+            except RouteRateLimited:
+                # Le salon a pu échouer sur un 429: attendre la fin de la limite plutôt que l'abandonner
+                await rest.maintenance(f"channel:{channel.id}", lambda: channel.delete(reason="Échec de la création du ticket"))
+            print(f"Salon {channel.id} supprimé suite à l'échec de la création du ticket")
+        except Exception as e:
+            print(f"Erreur lors de la suppression du salon {channel.id} après échec: {e}")
+        raise
     
-    # Sauvegarder le message avec bouton de fermeture
     close_button_messages[msg.id] = {"channel_id": channel.id, "guild_id": guild.id}
-    await save_close_button_message(msg.id, channel.id, guild.id)
+    ticket_channel_ids.add(channel.id)
+    record_stats_open(guild.id)
+    open_tickets[f"{user.id}_{guild.id}"] = {
+        "user_id": user.id,
+        "guild_id": guild.id,
+        "ticket_channel_id": channel.id,
+        "created_at": int(time.time())
+    }
     
     return channel
 
+# ----- Fermeture automatique des tickets inactifs -----
+# Intervalle d'écriture des activités en DB, et fréquence/taille des lots de fermeture
+ACTIVITY_FLUSH_SECONDS = int(os.getenv("ACTIVITY_FLUSH_SECONDS", "60"))
+INACTIVITY_CHECK_MINUTES = int(os.getenv("INACTIVITY_CHECK_MINUTES", "5"))
+INACTIVITY_CLOSE_BATCH = int(os.getenv("INACTIVITY_CLOSE_BATCH", "10"))
+INACTIVITY_CLOSE_DELAY = float(os.getenv("INACTIVITY_CLOSE_DELAY", "1"))
+
+def index_ticket_channels():
+    """Reconstruire l'ensemble des salons de tickets à partir des tickets ouverts"""
+    global ticket_channel_ids
+    ticket_channel_ids = {data["ticket_channel_id"] for data in open_tickets.values()}
+
+@bot.listen("on_message")
+async def track_ticket_activity(message: discord.Message):
+    """Noter en mémoire la dernière activité d'un salon de ticket, sans écriture DB"""
+    if message.author.bot or message.channel.id not in ticket_channel_ids:
+        return
+    ticket_activity[message.channel.id] = int(message.created_at.timestamp())
+
+async def write_pending_activity():
+    """Écrire par lot les activités accumulées depuis le dernier passage"""
+    global ticket_activity
+    if not ticket_activity:
+        return
+    
+    batch = ticket_activity
+    ticket_activity = {}
+    try:
+        await save_ticket_activity(batch)
+    except Exception as e:
+        # Remettre le lot en attente sans écraser une activité plus récente
+        for channel_id, ts in batch.items():
+            ticket_activity[channel_id] = max(ts, ticket_activity.get(channel_id, 0))
+        print(f"Erreur lors de l'écriture des activités de tickets: {e}")
+
+@tasks.loop(seconds=ACTIVITY_FLUSH_SECONDS)
+@loop_iteration
+async def flush_ticket_activity():
+    await write_pending_activity()
+
+@tasks.loop(minutes=INACTIVITY_CHECK_MINUTES)
+@loop_iteration
+async def close_inactive_tickets():
+    """Fermer par lots limités les tickets inactifs depuis trop longtemps"""
+    await write_pending_activity()
+
+    try:
+        expired = await find_inactive_tickets(int(time.time()), INACTIVITY_CLOSE_BATCH)
+    except Exception as e:
+        print(f"Erreur lors de la recherche des tickets inactifs: {e}")
+        return
+
+    for ticket in expired:
+        # Le reste du lot sera traité au prochain démarrage
+        if draining:
+            break
+        channel_id = ticket["ticket_channel_id"]
+        # Une activité arrivée depuis l'écriture du lot prolonge le ticket
+        if channel_id in ticket_activity:
+            continue
+        print(f"Fermeture pour inactivité: salon {channel_id} sur serveur {ticket['guild_id']}")
+        try:
+            await close_ticket(channel_id, "Ticket fermé pour inactivité", PRIORITY_MAINTENANCE)
+        except Exception as e:
+            print(f"Erreur lors de la fermeture pour inactivité du salon {channel_id}: {e}")
+        await asyncio.sleep(INACTIVITY_CLOSE_DELAY)
+
+# ----- Statistiques des tickets -----
+# Bornes supérieures (en secondes) des classes de l'histogramme des durées avant fermeture
+CLOSE_TIME_BOUNDS = [300, 900, 1800, 3600, 2 * 3600, 4 * 3600, 8 * 3600, 86400, 2 * 86400, 7 * 86400]
+# Nombre de jours conservés pour le compteur de tickets ouverts par jour
+STATS_WINDOW_DAYS = 30
+STATS_FLUSH_MINUTES = int(os.getenv("STATS_FLUSH_MINUTES", "5"))
+
+class GuildTicketStats:
+    """Compteurs et histogramme d'un serveur, mis à jour à chaque ouverture/fermeture.
+
+    La taille est bornée (STATS_WINDOW_DAYS jours + len(CLOSE_TIME_BOUNDS) classes),
+    donc toutes les lectures sont en O(1) quel que soit l'historique.
+    """
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None):
+        data = data or {}
+        self.open_count = data.get("open_count", 0)
+        self.total_opened = data.get("total_opened", 0)
+        self.total_closed = data.get("total_closed", 0)
+        self.opened_per_day = {int(day): count for day, count in data.get("opened_per_day", {}).items()}
+        self.close_histogram = data.get("close_histogram", [0] * (len(CLOSE_TIME_BOUNDS) + 1))
+        self.rate_limited = data.get("rate_limited", 0)
+
+    def merge(self, other: "GuildTicketStats"):
+        """Ajouter les compteurs d'un autre document (ligne trouvée en DB après coup)"""
+        self.open_count += other.open_count
+        self.total_opened += other.total_opened
+        self.total_closed += other.total_closed
+        for day, count in other.opened_per_day.items():
+            self.opened_per_day[day] = self.opened_per_day.get(day, 0) + count
+        self.close_histogram = [a + b for a, b in zip(self.close_histogram, other.close_histogram)]
+        self.rate_limited += other.rate_limited
+
+    def _trim(self, today: int):
+        for day in [day for day in self.opened_per_day if day <= today - STATS_WINDOW_DAYS]:
+            del self.opened_per_day[day]
+
+    def record_open(self, now: int):
+        today = now // 86400
+        self.open_count += 1
+        self.total_opened += 1
+        self.opened_per_day[today] = self.opened_per_day.get(today, 0) + 1
+        self._trim(today)
+
+    def record_close(self, created_at: Optional[int], now: int):
+        self.open_count = max(0, self.open_count - 1)
+        self.total_closed += 1
+        if created_at is None:
+            return
+        duration = max(0, now - created_at)
+        index = len(CLOSE_TIME_BOUNDS)
+        for i, bound in enumerate(CLOSE_TIME_BOUNDS):
+            if duration < bound:
+                index = i
+                break
+        self.close_histogram[index] += 1
+
+    def tickets_per_day(self, now: int, days: int) -> float:
+        """Moyenne des ouvertures par jour sur les `days` derniers jours (aujourd'hui inclus)"""
+        today = now // 86400
+        return sum(self.opened_per_day.get(today - i, 0) for i in range(days)) / days
+
+    def median_close_seconds(self) -> Optional[int]:
+        """Médiane estimée par interpolation linéaire dans la classe médiane"""
+        total = sum(self.close_histogram)
+        if total == 0:
+            return None
+        target = total / 2
+        cumulative = 0
+        for i, count in enumerate(self.close_histogram):
+            if count and cumulative + count >= target:
+                lower = CLOSE_TIME_BOUNDS[i - 1] if i > 0 else 0
+                upper = CLOSE_TIME_BOUNDS[i] if i < len(CLOSE_TIME_BOUNDS) else lower * 2
+                return int(lower + (upper - lower) * (target - cumulative) / count)
+            cumulative += count
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "open_count": self.open_count,
+            "total_opened": self.total_opened,
+            "total_closed": self.total_closed,
+            "opened_per_day": {str(day): count for day, count in self.opened_per_day.items()},
+            "close_histogram": self.close_histogram,
+            "rate_limited": self.rate_limited
+        }
+
+def get_guild_stats(guild_id: int) -> GuildTicketStats:
+    stats = ticket_stats.get(guild_id)
+    if stats is None:
+        stats = GuildTicketStats()
+        ticket_stats[guild_id] = stats
+        unmerged_stats.add(guild_id)
+    return stats
+
+async def load_missing_stats(guild_ids: Set[int]):
+    """Charger depuis la DB les statistiques des serveurs pas encore en mémoire"""
+    missing = [guild_id for guild_id in guild_ids if guild_id not in ticket_stats]
+    if not missing:
+        return
+    for guild_id, data in (await storage.load_ticket_stats(missing)).items():
+        if guild_id not in ticket_stats:
+            ticket_stats[guild_id] = GuildTicketStats(json.loads(data))
+
+def record_stats_open(guild_id: int):
+    get_guild_stats(guild_id).record_open(int(time.time()))
+    dirty_stats.add(guild_id)
+
+def record_stats_close(guild_id: int, created_at: Optional[int]):
+    get_guild_stats(guild_id).record_close(created_at, int(time.time()))
+    dirty_stats.add(guild_id)
+
+def record_stats_rate_limited(guild_id: int):
+    get_guild_stats(guild_id).rate_limited += 1
+    dirty_stats.add(guild_id)
+
+def reconcile_open_counts():
+    """Recaler les compteurs de tickets ouverts sur open_tickets après un rechargement complet"""
+    counts: Dict[int, int] = {}
+    for data in open_tickets.values():
+        counts[data["guild_id"]] = counts.get(data["guild_id"], 0) + 1
+    for guild_id in set(counts) | set(ticket_stats):
+        stats = get_guild_stats(guild_id)
+        if stats.open_count != counts.get(guild_id, 0):
+            stats.open_count = counts.get(guild_id, 0)
+            dirty_stats.add(guild_id)
+
+async def write_dirty_stats():
+    """Écrire les statistiques modifiées depuis le dernier passage"""
+    global dirty_stats
+    if not dirty_stats:
+        return
+    
+    guild_ids = dirty_stats
+    dirty_stats = set()
+    try:
+        # Ne pas écraser une ligne écrite par un autre processus (import) avant la création en mémoire
+        merging = [guild_id for guild_id in guild_ids if guild_id in unmerged_stats]
+        if merging:
+            for guild_id, data in (await storage.load_ticket_stats(merging)).items():
+                ticket_stats[guild_id].merge(GuildTicketStats(json.loads(data)))
+            unmerged_stats.difference_update(merging)
+        await storage.save_ticket_stats(
+            {guild_id: json.dumps(ticket_stats[guild_id].to_dict()) for guild_id in guild_ids},
+            int(time.time())
+        )
+    except Exception as e:
+        dirty_stats |= guild_ids
+        print(f"Erreur lors de l'écriture des statistiques: {e}")
+
+@tasks.loop(minutes=STATS_FLUSH_MINUTES)
+@loop_iteration
+async def flush_ticket_stats():
+    """Écrire périodiquement les statistiques modifiées"""
+    ticket_rate_limiter.log_hits()
+    await write_dirty_stats()
+
+def format_duration(seconds: int) -> str:
+    if seconds < 3600:
+        return f"{max(1, seconds // 60)} min"
+    if seconds < 86400:
+        return f"{seconds // 3600} h {seconds % 3600 // 60:02d} min"
+    return f"{seconds // 86400} j {seconds % 86400 // 3600} h"
+
 # ----- Tâche de mise à jour du status -----
 @tasks.loop(minutes=5)
+@loop_iteration
 async def update_status():
     """Met à jour les messages de status toutes les 5 minutes"""
     global status_messages
     current_time = int(discord.utils.utcnow().timestamp())
     
-    for guild_id, data in status_messages.items():
+    for guild_id, data in list(status_messages.items()):
+        if draining:
+            break
         guild = bot.get_guild(guild_id)
         if not guild:
             continue
@@ -492,13 +987,16 @@ async def update_status():
             continue
             
         try:
-            msg = await channel.fetch_message(data["message_id"])
-            await msg.edit(content=f"✅ Bot en ligne - <t:{current_time}:R>")
+            msg = await rest.maintenance(f"channel:{channel.id}", lambda: channel.fetch_message(data["message_id"]))
+            await rest.maintenance(f"channel:{channel.id}", lambda: msg.edit(content=f"✅ Bot en ligne - <t:{current_time}:R>"))
         except discord.NotFound:
             # Le message n'existe plus, le supprimer de la mémoire
-            await remove_status_message(guild_id)
             status_messages.pop(guild_id, None)
             print(f"Message de status supprimé pour {guild.name} (message introuvable)")
+            try:
+                await remove_status_message(guild_id)
+            except Exception as e:
+                print(f"Erreur lors de la suppression du status de {guild.name} en DB: {e}")
         except Exception as e:
             print(f"Erreur lors de la mise à jour du status pour {guild.name}: {e}")
 
@@ -540,6 +1038,10 @@ async def help(interaction: discord.Interaction):
 **category_name** (optionnel)
 • Nom de la catégorie pour les tickets
 • Par défaut: `TICKETS`
+
+**inactivity_hours** (optionnel)
+• Fermer automatiquement les tickets sans message depuis ce nombre d'heures
+• `0` pour désactiver
         """,
         inline=False
     )
@@ -569,9 +1071,15 @@ category_name:"SUPPORT"
         inline=False
     )
     
-    embed.set_footer(text="Seuls les administrateurs peuvent utiliser /config")
+    embed.add_field(
+        name="📊 Statistiques",
+        value="`/ticket-stats` : tickets ouverts, tickets par jour, temps médian avant fermeture et ouvertures refusées par la limite de débit",
+        inline=False
+    )
+    
+    embed.set_footer(text="Seuls les administrateurs peuvent utiliser /config et /ticket-stats")
     
-    await interaction.response.send_message(embed=embed, ephemeral=False)
+    await respond(interaction, embed=embed, ephemeral=False)
 
 @tree.command(description="[ADMIN] Configurer le système de tickets pour ce serveur")
 @app_commands.describe(
@@ -579,32 +1087,27 @@ category_name:"SUPPORT"
     message_text="Texte du message avec bouton",
     ticket_message="Message envoyé dans le ticket (utilise {user} pour mentionner l'utilisateur) - OBLIGATOIRE",
     staff_role_id="ID du rôle staff (optionnel)",
-    category_name="Nom de la catégorie des tickets (optionnel)"
+    category_name="Nom de la catégorie des tickets (optionnel)",
+    inactivity_hours="Fermer les tickets inactifs après ce nombre d'heures, 0 pour désactiver (optionnel)"
 )
+@tracked_inflight
 async def config(interaction: discord.Interaction, channel_id: str, message_text: str, 
-                ticket_message: str, staff_role_id: str = None, category_name: str = None):
+                ticket_message: str, staff_role_id: str = None, category_name: str = None,
+                inactivity_hours: app_commands.Range[int, 0, 8760] = None):
     guild = interaction.guild
     if not guild:
-        return await interaction.response.send_message(
-            "Cette commande doit être utilisée sur le serveur.", ephemeral=True
-        )
+        return await respond(interaction, "Cette commande doit être utilisée sur le serveur.", ephemeral=True)
 
     # Vérification permission ADMIN
     if not interaction.user.guild_permissions.administrator:
-        return await interaction.response.send_message(
-            "❌ Seuls les administrateurs peuvent utiliser cette commande.", ephemeral=True
-        )
+        return await respond(interaction, "❌ Seuls les administrateurs peuvent utiliser cette commande.", ephemeral=True)
 
     try:
         channel = guild.get_channel(int(channel_id))
         if not channel:
-            return await interaction.response.send_message(
-                "Salon introuvable.", ephemeral=True
-            )
+            return await respond(interaction, "Salon introuvable.", ephemeral=True)
     except:
-        return await interaction.response.send_message(
-            "ID de salon invalide.", ephemeral=True
-        )
+        return await respond(interaction, "ID de salon invalide.", ephemeral=True)
 
     # Mettre à jour la configuration du serveur
     updates = {}
@@ -614,17 +1117,17 @@ async def config(interaction: discord.Interaction, channel_id: str, message_text
         try:
             updates["staff_role_id"] = int(staff_role_id)
         except:
-            return await interaction.response.send_message(
-                "ID de rôle staff invalide.", ephemeral=True
-            )
+            return await respond(interaction, "ID de rôle staff invalide.", ephemeral=True)
     if category_name:
         updates["category_name"] = category_name
+    if inactivity_hours is not None:
+        updates["inactivity_timeout_hours"] = inactivity_hours or None
     
     if updates:
         await update_server_config(guild.id, updates)
 
     # Créer le message avec bouton
-    msg = await channel.send(message_text, view=TicketButton())
+    msg = await rest.interaction(f"channel:{channel.id}", lambda: channel.send(message_text, view=TicketButton()))
     
     # Sauvegarder le message de ticket
     global ticket_messages
@@ -641,17 +1144,81 @@ async def config(interaction: discord.Interaction, channel_id: str, message_text
             response_parts.append(f"✅ Rôle staff configuré : {role.mention}")
     if category_name:
         response_parts.append(f"✅ Catégorie des tickets : `{category_name}`")
+    if inactivity_hours:
+        response_parts.append(f"✅ Fermeture automatique après {inactivity_hours} h d'inactivité")
+    elif inactivity_hours == 0:
+        response_parts.append("✅ Fermeture automatique des tickets inactifs désactivée")
 
-    await interaction.response.send_message("\n".join(response_parts), ephemeral=True)
+    await respond(interaction, "\n".join(response_parts), ephemeral=True)
+
+@tree.command(name="ticket-stats", description="[ADMIN] Statistiques des tickets de ce serveur")
+async def ticket_stats_command(interaction: discord.Interaction):
+    guild = interaction.guild
+    if not guild:
+        return await respond(interaction, "Cette commande doit être utilisée sur le serveur.", ephemeral=True)
+
+    if not interaction.user.guild_permissions.administrator:
+        return await respond(interaction, "❌ Seuls les administrateurs peuvent utiliser cette commande.", ephemeral=True)
+
+    # Lecture des compteurs en mémoire uniquement, sans requête DB
+    stats = get_guild_stats(guild.id)
+    now = int(time.time())
+    median = stats.median_close_seconds()
+
+    embed = discord.Embed(title=f"📊 Statistiques des tickets - {guild.name}", color=0x00ff00)
+    embed.add_field(name="🎫 Tickets ouverts", value=str(stats.open_count), inline=True)
+    embed.add_field(name="📅 Ouverts aujourd'hui", value=str(stats.opened_per_day.get(now // 86400, 0)), inline=True)
+    embed.add_field(name="📈 Moyenne par jour (7 j)", value=f"{stats.tickets_per_day(now, 7):.1f}", inline=True)
+    embed.add_field(name="📈 Moyenne par jour (30 j)", value=f"{stats.tickets_per_day(now, STATS_WINDOW_DAYS):.1f}", inline=True)
+    embed.add_field(name="✅ Tickets fermés", value=str(stats.total_closed), inline=True)
+    embed.add_field(
+        name="⏱️ Temps médian avant fermeture",
+        value=f"~{format_duration(median)}" if median is not None else "Pas encore de données",
+        inline=True
+    )
+    embed.add_field(name="🚦 Ouvertures refusées (limite de débit)", value=str(stats.rate_limited), inline=True)
+    embed.set_footer(text=f"{stats.total_opened} ticket(s) ouvert(s) depuis le début du suivi")
+
+    await respond(interaction, embed=embed, ephemeral=True)
+
+@tree.command(name="ticket-export", description="[ADMIN] Exporter la configuration et l'état des tickets de ce serveur")
+@tracked_inflight
+async def ticket_export(interaction: discord.Interaction):
+    guild = interaction.guild
+    if not guild:
+        return await respond(interaction, "Cette commande doit être utilisée sur le serveur.", ephemeral=True)
+
+    if not interaction.user.guild_permissions.administrator:
+        return await respond(interaction, "❌ Seuls les administrateurs peuvent utiliser cette commande.", ephemeral=True)
+
+    await rest.interaction(f"interaction:{interaction.id}", lambda: interaction.response.defer(ephemeral=True))
+
+    # Seul le serveur courant est exporté; l'import se fait avec `python storage.py import`
+    buffer = io.BytesIO()
+    counts = await storage.export_guilds(buffer, [guild.id])
+    buffer.seek(0)
+
+    summary = "\n".join(f"• `{table}` : {count} ligne(s)" for table, count in counts.items())
+    await respond(
+        interaction,
+        f"📦 Export du serveur {guild.name} :\n{summary}",
+        file=discord.File(buffer, filename=f"tickets-{guild.id}.export"),
+        ephemeral=True
+    )
 
 # ----- Vérification automatique des messages de tickets (toutes les heures) -----
 @tasks.loop(hours=1)
+@loop_iteration
 async def check_ticket_messages():
     """Vérifier si les messages avec boutons de tickets existent encore"""
     global ticket_messages
     
     # Charger les messages depuis la DB
-    ticket_messages = await load_ticket_messages()
+    try:
+        ticket_messages = await load_ticket_messages()
+    except Exception as e:
+        print(f"Erreur lors du chargement des messages de tickets: {e}")
+        return
     
     for guild_id, messages in ticket_messages.items():
         guild = bot.get_guild(guild_id)
@@ -660,23 +1227,30 @@ async def check_ticket_messages():
             
         messages_copy = messages.copy()
         for msg_id, channel_id in messages_copy.items():
+            if draining:
+                return
             channel = guild.get_channel(channel_id)
             if not channel:
                 # Le salon n'existe plus
-                await remove_ticket_message(guild_id, msg_id)
-                del ticket_messages[guild_id][msg_id]
-                print(f"Message de ticket {msg_id} supprimé de la DB car le salon {channel_id} n'existe plus dans {guild.name}")
-                continue
-                
+                reason = f"le salon {channel_id} n'existe plus"
+            else:
+                try:
+                    await rest.maintenance(f"channel:{channel.id}", lambda: channel.fetch_message(msg_id))
+                    continue
+                except discord.NotFound:
+                    # Le message n'existe plus
+                    reason = "le message n'existe plus"
+                except Exception as e:
+                    print(f"Erreur lors de la vérification du message {msg_id}: {e}")
+                    continue
+            
             try:
-                await channel.fetch_message(msg_id)
-            except discord.NotFound:
-                # Le message n'existe plus
                 await remove_ticket_message(guild_id, msg_id)
-                del ticket_messages[guild_id][msg_id]
-                print(f"Message de ticket {msg_id} supprimé de la DB car le message n'existe plus dans {guild.name}")
             except Exception as e:
-                print(f"Erreur lors de la vérification du message {msg_id}: {e}")
+                print(f"Erreur lors de la suppression du message de ticket {msg_id}: {e}")
+                continue
+            del ticket_messages[guild_id][msg_id]
+            print(f"Message de ticket {msg_id} supprimé de la DB car {reason} dans {guild.name}")
         
         # Nettoyer les entrées vides
         if guild_id in ticket_messages and not ticket_messages[guild_id]:
@@ -684,12 +1258,18 @@ async def check_ticket_messages():
 
 # ----- Vérification automatique des tickets ouverts -----
 @tasks.loop(minutes=2)
+@loop_iteration
 async def check_tickets():
     """Vérifier toutes les 2 minutes si les tickets ouverts existent encore"""
     global open_tickets
     
     # Charger les tickets depuis la DB
-    open_tickets = await load_open_tickets()
+    try:
+        open_tickets = await load_open_tickets()
+    except Exception as e:
+        print(f"Erreur lors du chargement des tickets ouverts: {e}")
+        return
+    index_ticket_channels()
     
     for key, ticket_data in open_tickets.copy().items():
         channel_id = ticket_data["ticket_channel_id"]
@@ -699,36 +1279,67 @@ async def check_tickets():
         guild = bot.get_guild(guild_id)
         if not guild:
             # Le serveur n'existe plus ou le bot n'y est plus
-            await remove_open_ticket(user_id, guild_id)
-            del open_tickets[key]
-            print(f"Ticket {key} supprimé de la DB car le serveur {guild_id} n'est plus accessible.")
-            continue
-            
-        channel = guild.get_channel(channel_id)
-        if not channel:
+            reason = f"le serveur {guild_id} n'est plus accessible"
+        elif not guild.get_channel(channel_id):
             # Le salon n'existe plus
+            reason = f"le salon {channel_id} n'existe plus dans {guild.name}"
+        else:
+            continue
+        
+        try:
             await remove_open_ticket(user_id, guild_id)
-            del open_tickets[key]
-            print(f"Ticket {key} supprimé de la DB car le salon {channel_id} n'existe plus dans {guild.name}.")
+        except Exception as e:
+            print(f"Erreur lors de la suppression du ticket {key}: {e}")
             continue
-
-# ----- on_ready -----
-@bot.event
-async def on_ready():
-    global status_messages, ticket_messages, open_tickets, close_button_messages
+        del open_tickets[key]
+        print(f"Ticket {key} supprimé de la DB car {reason}.")
     
-    # Initialiser la base de données
-    await init_database()
+    # Les serveurs importés depuis le démarrage reprennent leurs statistiques avant le recalage
+    try:
+        await load_missing_stats({data["guild_id"] for data in open_tickets.values()})
+    except Exception as e:
+        print(f"Erreur lors du chargement des statistiques: {e}")
+        return
     
-    await tree.sync()
-    print(f"[Manager] Connecté en tant que {bot.user}")
-
-    # Recharger toutes les données depuis la DB
-    ticket_messages = await load_ticket_messages()
-    open_tickets = await load_open_tickets()
-    close_button_messages = await load_close_button_messages()
-    status_messages = await load_status_messages()
+    # Les tickets disparus sans passer par la fermeture sont retirés des compteurs
+    reconcile_open_counts()
+
+# ----- Synchronisation des commandes -----
+# Serveur de développement: si défini, les commandes y sont synchronisées (immédiat)
+# au lieu de la synchronisation globale (lente et fortement limitée)
+DEV_GUILD_ID = os.getenv("DEV_GUILD_ID")
+# Forcer la synchronisation même si l'empreinte n'a pas changé
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "0") == "1"
+
+def command_tree_fingerprint(guild: Optional[discord.abc.Snowflake] = None) -> str:
+    """Empreinte SHA-256 de la définition des commandes telle qu'envoyée à Discord"""
+    payload = [command.to_dict(tree) for command in tree.get_commands(guild=guild)]
+    payload.sort(key=lambda command: (command.get("type", 1), command["name"]))
+    serialized = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+async def sync_command_tree():
+    """Synchroniser les commandes uniquement si leur empreinte a changé"""
+    if DEV_GUILD_ID:
+        guild = discord.Object(id=int(DEV_GUILD_ID))
+        tree.copy_global_to(guild=guild)
+        scope = f"guild:{guild.id}"
+    else:
+        guild = None
+        scope = "global"
+    
+    key = f"command_tree_hash:{bot.application_id}:{scope}"
+    fingerprint = command_tree_fingerprint(guild)
+    if not FORCE_COMMAND_SYNC and await storage.get_metadata(key) == fingerprint:
+        print(f"Commandes inchangées ({scope}), synchronisation ignorée")
+        return
+    
+    await rest.maintenance("application:commands", lambda: tree.sync(guild=guild))
+    await storage.set_metadata(key, fingerprint)
+    print(f"Commandes synchronisées ({scope})")
 
+async def restore_message_buttons():
+    """Rééditer les messages de ticket et de fermeture avec les vues actuelles"""
     # Restaurer les boutons des messages de ticket pour tous les serveurs
     for guild_id, messages in ticket_messages.items():
         guild = bot.get_guild(guild_id)
@@ -739,8 +1350,8 @@ async def on_ready():
             channel = guild.get_channel(channel_id)
             if channel:
                 try:
-                    msg = await channel.fetch_message(msg_id)
-                    await msg.edit(view=TicketButton())
+                    msg = await rest.maintenance(f"channel:{channel.id}", lambda: channel.fetch_message(msg_id))
+                    await rest.maintenance(f"channel:{channel.id}", lambda: msg.edit(view=TicketButton()))
                     print(f"Bouton de ticket restauré pour le message {msg_id} dans {guild.name}")
                 except Exception as e:
                     print(f"Erreur lors de la restauration du bouton de ticket {msg_id} dans {guild.name}: {e}")
@@ -754,72 +1365,149 @@ async def on_ready():
             channel = guild.get_channel(channel_id)
             if channel:
                 try:
-                    msg = await channel.fetch_message(msg_id)
-                    await msg.edit(view=CloseTicketButton())
+                    msg = await rest.maintenance(f"channel:{channel.id}", lambda: channel.fetch_message(msg_id))
+                    await rest.maintenance(f"channel:{channel.id}", lambda: msg.edit(view=CloseTicketButton()))
                     print(f"Bouton de fermeture restauré pour le message {msg_id} dans {guild.name}")
                 except Exception as e:
                     print(f"Erreur lors de la restauration du bouton de fermeture {msg_id}: {e}")
 
+# ----- on_ready -----
+# startup_done ne passe à True qu'une fois le démarrage terminé: après un échec,
+# la reconnexion suivante (nouvel on_ready) relance le démarrage
+startup_done = False
+startup_running = False
+
+@bot.event
+async def on_ready():
+    global startup_done, startup_running
+    
+    # on_ready est aussi appelé après une reconnexion: l'état et les tâches sont déjà en place
+    if startup_done:
+        print(f"[Manager] Reconnecté en tant que {bot.user}")
+        return
+    if startup_running:
+        return
+    
+    startup_running = True
+    try:
+        await startup()
+        startup_done = True
+    finally:
+        startup_running = False
+
+def start_loop_later(loop_task: tasks.Loop):
+    """Démarrer une tâche périodique après un intervalle, sauf si l'arrêt a commencé"""
+    delay = (loop_task.hours or 0) * 3600 + (loop_task.minutes or 0) * 60 + (loop_task.seconds or 0)
+    
+    def start():
+        if not draining and not loop_task.is_running():
+            loop_task.start()
+    
+    asyncio.get_running_loop().call_later(delay, start)
+
+async def startup():
+    """Initialiser la base, synchroniser les commandes, restaurer l'état et démarrer les tâches"""
+    global status_messages, ticket_messages, open_tickets, close_button_messages, ticket_stats
+    
+    # Initialiser la base de données (déjà fait si un démarrage précédent a échoué plus loin)
+    if storage is None:
+        await init_database()
+    
+    await sync_command_tree()
+    print(f"[Manager] Connecté en tant que {bot.user}")
+
+    # Reprendre l'état de l'instantané laissé par l'arrêt précédent, sinon tout recharger depuis la DB
+    snapshot = load_state_snapshot()
+    if snapshot:
+        ticket_messages = snapshot["ticket_messages"]
+        open_tickets = snapshot["open_tickets"]
+        close_button_messages = snapshot["close_button_messages"]
+        status_messages = snapshot["status_messages"]
+        ticket_stats = snapshot["ticket_stats"]
+        print(f"♻️ État restauré depuis l'instantané {SNAPSHOT_PATH}")
+    else:
+        ticket_messages = await load_ticket_messages()
+        open_tickets = await load_open_tickets()
+        close_button_messages = await load_close_button_messages()
+        ticket_stats = {
+            guild_id: GuildTicketStats(json.loads(data))
+            for guild_id, data in (await storage.load_ticket_stats()).items()
+        }
+        status_messages = await load_status_messages()
+    index_ticket_channels()
+    reconcile_open_counts()
+
+    # Les boutons ont un custom_id fixe et leurs vues sont enregistrées dans setup_hook.
+    # Au démarrage à froid, les messages sont réédités une fois pour migrer les anciens
+    # boutons (custom_id aléatoire); après un instantané, ils l'ont déjà été
+    if not snapshot:
+        await restore_message_buttons()
+
     # Initialiser les messages de status pour les serveurs configurés
-    async with db_pool.acquire() as conn:
-        rows = await conn.fetch('''
-            SELECT guild_id, status_channel_id FROM servers_config 
-            WHERE status_channel_id IS NOT NULL
-        ''')
-        
-        current_time = int(discord.utils.utcnow().timestamp())
+    rows = await list_status_channels()
+    
+    current_time = int(discord.utils.utcnow().timestamp())
+    
+    for row in rows:
+        guild_id = row["guild_id"]
+        status_channel_id = row["status_channel_id"]
         
-        for row in rows:
-            guild_id = row["guild_id"]
-            status_channel_id = row["status_channel_id"]
-            
-            guild = bot.get_guild(guild_id)
-            if not guild:
-                print(f"Serveur {guild_id} non accessible au démarrage")
-                continue
-                
-            channel = guild.get_channel(status_channel_id)
-            if not channel:
-                print(f"Salon de status {status_channel_id} non trouvé dans {guild.name}")
-                continue
-            
-            message_created = False
-            
-            # Vérifier si on a déjà un message de status en DB
-            if guild_id in status_messages:
-                message_id = status_messages[guild_id]["message_id"]
-                try:
-                    msg = await channel.fetch_message(message_id)
-                    await msg.edit(content=f"✅ Bot en ligne (redémarré) - <t:{current_time}:R>")
-                    message_created = True
-                    print(f"Message de status restauré pour {guild.name}")
-                except discord.NotFound:
-                    print(f"Message de status {message_id} non trouvé dans {guild.name}, création d'un nouveau")
-                    # Le message n'existe plus, supprimer de la mémoire
-                    status_messages.pop(guild_id, None)
-                except Exception as e:
-                    print(f"Erreur lors de la restauration du status pour {guild.name}: {e}")
+        guild = bot.get_guild(guild_id)
+        if not guild:
+            print(f"Serveur {guild_id} non accessible au démarrage")
+            continue
             
-            # Si aucun message existant ou restauration échouée, créer un nouveau
-            if not message_created:
-                try:
-                    msg = await channel.send(f"✅ Bot en ligne (redémarré) - <t:{current_time}:R>")
-                    await save_status_message(guild_id, msg.id, channel.id)
-                    status_messages[guild_id] = {"message_id": msg.id, "channel_id": channel.id}
-                    print(f"Nouveau message de status créé au démarrage pour {guild.name}")
-                except discord.Forbidden:
-                    print(f"Pas de permission pour envoyer un message dans le salon de status de {guild.name}")
-                except Exception as e:
-                    print(f"Erreur lors de la création du message de status pour {guild.name}: {e}")
+        channel = guild.get_channel(status_channel_id)
+        if not channel:
+            print(f"Salon de status {status_channel_id} non trouvé dans {guild.name}")
+            continue
+        
+        message_created = False
+        
+        # Vérifier si on a déjà un message de status en DB
+        if guild_id in status_messages:
+            message_id = status_messages[guild_id]["message_id"]
+            try:
+                msg = await rest.maintenance(f"channel:{channel.id}", lambda: channel.fetch_message(message_id))
+                await rest.maintenance(f"channel:{channel.id}", lambda: msg.edit(content=f"✅ Bot en ligne (redémarré) - <t:{current_time}:R>"))
+                message_created = True
+                print(f"Message de status restauré pour {guild.name}")
+            except discord.NotFound:
+                print(f"Message de status {message_id} non trouvé dans {guild.name}, création d'un nouveau")
+                # Le message n'existe plus, supprimer de la mémoire
+                status_messages.pop(guild_id, None)
+            except Exception as e:
+                print(f"Erreur lors de la restauration du status pour {guild.name}: {e}")
+        
+        # Si aucun message existant ou restauration échouée, créer un nouveau
+        if not message_created:
+            try:
+                msg = await rest.maintenance(f"channel:{channel.id}", lambda: channel.send(f"✅ Bot en ligne (redémarré) - <t:{current_time}:R>"))
+                await save_status_message(guild_id, msg.id, channel.id)
+                status_messages[guild_id] = {"message_id": msg.id, "channel_id": channel.id}
+                print(f"Nouveau message de status créé au démarrage pour {guild.name}")
+            except discord.Forbidden:
+                print(f"Pas de permission pour envoyer un message dans le salon de status de {guild.name}")
+            except Exception as e:
+                print(f"Erreur lors de la création du message de status pour {guild.name}: {e}")
 
-    # Démarrer les tâches
+    # Démarrer les tâches. Après un instantané, le rechargement complet des tickets
+    # et des messages depuis la DB est repoussé d'un intervalle
     update_status.start()
-    check_tickets.start()
-    check_ticket_messages.start()
+    if snapshot:
+        start_loop_later(check_tickets)
+        start_loop_later(check_ticket_messages)
+    else:
+        check_tickets.start()
+        check_ticket_messages.start()
+    flush_ticket_activity.start()
+    close_inactive_tickets.start()
+    flush_ticket_stats.start()
     
     print(f"Bot prêt ! Configuré sur {len(ticket_messages)} serveur(s) avec des messages de tickets.")
     print(f"Tickets ouverts actuellement: {len(open_tickets)}")
     print(f"Messages de status configurés: {len(status_messages)}")
+    log_memory_usage()
     
     # Afficher un résumé des serveurs configurés
     for guild_id, messages in ticket_messages.items():
@@ -829,12 +1517,141 @@ async def on_ready():
         print(f"  - {guild_name}: {tickets_count} message(s) de tickets configuré(s)")
 
 # ----- Gestion propre de la fermeture -----
+# Délai maximal (en secondes) pour terminer les traitements en cours à l'arrêt
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "20"))
+# Instantané local de l'état en mémoire, relu au démarrage suivant s'il est assez récent
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "ticket_state.snapshot.json")
+SNAPSHOT_MAX_AGE = int(os.getenv("SNAPSHOT_MAX_AGE", "300"))
+# Version 2: les boutons des messages connus ont un custom_id fixe
+SNAPSHOT_VERSION = 2
+
+shutdown_task = None
+
+def database_fingerprint() -> str:
+    """Identifier la base sans écrire l'URL (et son mot de passe) sur le disque"""
+    return hashlib.sha256((DATABASE_URL or "").encode()).hexdigest()[:16]
+
+def write_state_snapshot():
+    """Écrire l'état en mémoire dans un fichier JSON compact (écriture atomique)"""
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "written_at": int(time.time()),
+        "database": database_fingerprint(),
+        "ticket_messages": {
+            str(guild_id): {str(msg_id): channel_id for msg_id, channel_id in messages.items()}
+            for guild_id, messages in ticket_messages.items()
+        },
+        "open_tickets": open_tickets,
+        "close_button_messages": {str(msg_id): data for msg_id, data in close_button_messages.items()},
+        "status_messages": {str(guild_id): data for guild_id, data in status_messages.items()},
+        "ticket_stats": {str(guild_id): stats.to_dict() for guild_id, stats in ticket_stats.items()}
+    }
+    
+    tmp_path = f"{SNAPSHOT_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, separators=(",", ":"))
+    os.replace(tmp_path, SNAPSHOT_PATH)
+    print(f"💾 Instantané de l'état écrit: {len(open_tickets)} ticket(s) ouvert(s)")
+
+def load_state_snapshot() -> Optional[Dict[str, Any]]:
+    """Lire l'instantané s'il est récent et correspond à la même base, puis le supprimer"""
+    try:
+        with open(SNAPSHOT_PATH, encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Instantané illisible, rechargement depuis la DB: {e}")
+        return None
+    finally:
+        # Un instantané ne sert qu'une fois: l'état évolue ensuite dans la DB
+        try:
+            os.remove(SNAPSHOT_PATH)
+        except OSError:
+            pass
+    
+    age = int(time.time()) - snapshot.get("written_at", 0)
+    if snapshot.get("version") != SNAPSHOT_VERSION or snapshot.get("database") != database_fingerprint():
+        print("Instantané ignoré (version ou base différente)")
+        return None
+    if age > SNAPSHOT_MAX_AGE:
+        print(f"Instantané ignoré (trop ancien: {age}s)")
+        return None
+    
+    return {
+        "ticket_messages": {
+            int(guild_id): {int(msg_id): channel_id for msg_id, channel_id in messages.items()}
+            for guild_id, messages in snapshot["ticket_messages"].items()
+        },
+        "open_tickets": snapshot["open_tickets"],
+        "close_button_messages": {int(msg_id): data for msg_id, data in snapshot["close_button_messages"].items()},
+        "status_messages": {int(guild_id): data for guild_id, data in snapshot["status_messages"].items()},
+        "ticket_stats": {int(guild_id): GuildTicketStats(data) for guild_id, data in snapshot["ticket_stats"].items()}
+    }
+
+async def drain_and_shutdown():
+    """Arrêt progressif: refuser les interactions, finir les traitements, sauvegarder, fermer"""
+    global draining
+    if draining:
+        return
+    draining = True
+    print("\n🛑 Arrêt du bot demandé: plus aucune nouvelle interaction acceptée")
+    
+    # Les itérations des tâches périodiques et les traitements en cours doivent finir
+    # avant la sauvegarde et la fermeture de la DB (aucune nouvelle itération ne démarre)
+    try:
+        await asyncio.wait_for(inflight_idle.wait(), DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"⚠️ {inflight_count} traitement(s) encore en cours après {DRAIN_TIMEOUT}s, arrêt forcé")
+    
+    # Les tâches périodiques ne font plus qu'attendre leur prochaine itération
+    loop_tasks = []
+    for loop_task in (update_status, check_tickets, check_ticket_messages, close_inactive_tickets,
+                      flush_ticket_activity, flush_ticket_stats):
+        if loop_task.is_running():
+            loop_tasks.append(loop_task.get_task())
+            loop_task.cancel()
+    await asyncio.gather(*loop_tasks, return_exceptions=True)
+    
+    if storage:
+        try:
+            await write_pending_activity()
+            await write_dirty_stats()
+            if startup_done:
+                write_state_snapshot()
+        except Exception as e:
+            print(f"Erreur lors de la sauvegarde finale: {e}")
+    
+    await cleanup_on_exit()
+    await bot.close()
+
+@bot.event
+async def setup_hook():
+    # Vues persistantes: les boutons (custom_id fixe) fonctionnent sans rééditer les messages
+    bot.add_view(TicketButton())
+    bot.add_view(CloseTicketButton())
+    
+    # Intercepter SIGINT/SIGTERM dans la boucle asyncio pour lancer l'arrêt progressif
+    def request_shutdown():
+        global shutdown_task
+        if shutdown_task is None:
+            shutdown_task = asyncio.create_task(drain_and_shutdown())
+    
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, request_shutdown)
+        except NotImplementedError:
+            # Windows: pas de gestion des signaux dans la boucle asyncio
+            pass
+
 async def cleanup_on_exit():
     """Fermer proprement la connexion à la base de données"""
-    global db_pool
-    if db_pool:
-        await db_pool.close()
-        print("🔌 Connexion PostgreSQL fermée")
+    global storage
+    if storage:
+        await storage.close()
+        print(f"🔌 Connexion {storage.name} fermée")
+        storage = None
 
 # ----- Keep alive pour Render -----
 import threading
@@ -849,21 +1666,12 @@ def home():
 def run_flask():
     app.run(host="0.0.0.0", port=10000)
 
-threading.Thread(target=run_flask).start()
+# Thread démon: il ne doit pas empêcher le processus de se terminer après l'arrêt du bot
+threading.Thread(target=run_flask, daemon=True).start()
 
 # ----- Lancement du bot -----
 if __name__ == "__main__":
-    import signal
-    
-    def signal_handler(sig, frame):
-        print("\n🛑 Arrêt du bot demandé...")
-        import asyncio
-        asyncio.create_task(cleanup_on_exit())
-        exit(0)
-    
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    
+    # SIGINT/SIGTERM sont gérés dans setup_hook (arrêt progressif)
     token = os.getenv("DISCORD_TOKEN")
     if not token:
         print("❌ DISCORD_TOKEN manquant dans les variables d'environnement")
@@ -11,5 +11,6 @@ def run():
     app.run(host='0.0.0.0', port=8080)
 
 def keep_alive():
-    t = Thread(target=run)
+    # Thread démon: il ne doit pas empêcher le processus de se terminer après l'arrêt du bot
+    t = Thread(target=run, daemon=True)
     t.start()
@@ -16,7 +16,8 @@ def run_flask():
     app.run(host='0.0.0.0', port=8080)
 
 def keep_alive():
-    t = Thread(target=run_flask)
+    # Thread démon: il ne doit pas empêcher le processus de se terminer après l'arrêt du bot
+    t = Thread(target=run_flask, daemon=True)
     t.start()
 
 # ----- Charger les variables d'environnement -----
@@ -0,0 +1,1395 @@
+import os
+import time
+import random
+import asyncio
+import sqlite3
+import struct
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List
+import asyncpg
+
+# ---------------------------------
+# ----- Stockage des données du bot -----
+# Le bot ne parle qu'à l'interface Storage; le backend est choisi d'après DATABASE_URL:
+#   postgres://...            -> PostgresStorage (asyncpg)
+#   sqlite:///tickets.db      -> SQLiteStorage (chemin relatif)
+#   sqlite:////data/tickets.db -> SQLiteStorage (chemin absolu)
+
+DEFAULT_TICKET_MESSAGE = "{user} Merci d'avoir ouvert un ticket. Un membre du staff va te répondre."
+
+# Champs de servers_config modifiables via update_server_config
+CONFIG_FIELDS = ["category_name", "staff_role_id", "ticket_message", "status_channel_id", "inactivity_timeout_hours"]
+
+# Colonnes et clé primaire de chaque table, utilisées par la migration entre backends
+TABLES = {
+    "servers_config": {
+        "columns": ["guild_id", "category_name", "staff_role_id", "ticket_message",
+                    "status_channel_id", "inactivity_timeout_hours", "created_at"],
+        "key": ["guild_id"]
+    },
+    "ticket_messages": {
+        "columns": ["message_id", "guild_id", "channel_id", "created_at"],
+        "key": ["message_id", "guild_id"]
+    },
+    "open_tickets": {
+        "columns": ["user_id", "guild_id", "ticket_channel_id", "created_at", "last_activity_ts"],
+        "key": ["user_id", "guild_id"]
+    },
+    "close_button_messages": {
+        "columns": ["message_id", "channel_id", "guild_id", "created_at"],
+        "key": ["message_id"]
+    },
+    "status_messages": {
+        "columns": ["guild_id", "message_id", "channel_id", "created_at"],
+        "key": ["guild_id"]
+    },
+    "ticket_stats": {
+        "columns": ["guild_id", "data", "updated_at"],
+        "key": ["guild_id"]
+    },
+    "bot_metadata": {
+        "columns": ["key", "value"],
+        "key": ["key"]
+    }
+}
+
+# Tables exportées par serveur (toutes ont une colonne guild_id) et format du fichier d'export:
+# EXPORT_MAGIC, puis pour chaque table un en-tête (nom, colonnes) suivi des blocs COPY binaires
+# de PostgreSQL préfixés par leur taille, le dernier bloc étant de taille 0.
+# Le même fichier s'importe dans l'un ou l'autre backend
+EXPORT_TABLES = ["servers_config", "ticket_messages", "open_tickets",
+                 "close_button_messages", "status_messages", "ticket_stats"]
+EXPORT_MAGIC = b"TICKETEXPORT1\n"
+
+# Type PostgreSQL de chaque colonne exportée, pour lire/écrire le format COPY binaire sans PostgreSQL
+EXPORT_COLUMN_TYPES = {
+    "guild_id": "int8", "message_id": "int8", "channel_id": "int8", "user_id": "int8",
+    "ticket_channel_id": "int8", "staff_role_id": "int8", "status_channel_id": "int8",
+    "last_activity_ts": "int8", "updated_at": "int8", "inactivity_timeout_hours": "int4",
+    "category_name": "text", "ticket_message": "text", "data": "text", "created_at": "timestamp"
+}
+PGCOPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+# Les TIMESTAMP PostgreSQL comptent les microsecondes depuis le 2000-01-01 (UTC)
+PG_EPOCH_OFFSET = 946684800
+
+def _write_export_header(output, table: str, columns: List[str]):
+    for value in (table, ",".join(columns)):
+        encoded = value.encode()
+        output.write(struct.pack(">H", len(encoded)))
+        output.write(encoded)
+
+def _read_exact(source, size: int) -> bytes:
+    data = source.read(size)
+    if len(data) != size:
+        raise ValueError("Fichier d'export tronqué")
+    return data
+
+def _read_export_chunks(source):
+    """Lire les blocs d'une table jusqu'au bloc de taille 0"""
+    while True:
+        size = struct.unpack(">I", _read_exact(source, 4))[0]
+        if size == 0:
+            return
+        yield _read_exact(source, size)
+
+def _encode_copy_value(kind: str, value) -> bytes:
+    if kind == "int8":
+        return struct.pack(">q", value)
+    if kind == "int4":
+        return struct.pack(">i", value)
+    if kind == "timestamp":
+        return struct.pack(">q", (value - PG_EPOCH_OFFSET) * 1000000)
+    return str(value).encode()
+
+def _decode_copy_value(kind: str, raw: bytes):
+    if kind == "int8":
+        return struct.unpack(">q", raw)[0]
+    if kind == "int4":
+        return struct.unpack(">i", raw)[0]
+    if kind == "timestamp":
+        return struct.unpack(">q", raw)[0] // 1000000 + PG_EPOCH_OFFSET
+    return raw.decode()
+
+def _encode_copy_rows(columns: List[str], rows) -> bytes:
+    """Encoder des lignes au format COPY binaire de PostgreSQL"""
+    kinds = [EXPORT_COLUMN_TYPES[column] for column in columns]
+    parts = [PGCOPY_SIGNATURE, struct.pack(">ii", 0, 0)]
+    for row in rows:
+        parts.append(struct.pack(">h", len(columns)))
+        for kind, value in zip(kinds, row):
+            if value is None:
+                parts.append(struct.pack(">i", -1))
+                continue
+            encoded = _encode_copy_value(kind, value)
+            parts.append(struct.pack(">i", len(encoded)))
+            parts.append(encoded)
+    parts.append(struct.pack(">h", -1))
+    return b"".join(parts)
+
+def _decode_copy_rows(columns: List[str], data: bytes) -> List[tuple]:
+    """Décoder un flux COPY binaire de PostgreSQL en tuples"""
+    if not data.startswith(PGCOPY_SIGNATURE):
+        raise ValueError("Bloc COPY binaire invalide dans l'export")
+    kinds = [EXPORT_COLUMN_TYPES[column] for column in columns]
+    rows = []
+    try:
+        pos = len(PGCOPY_SIGNATURE)
+        _flags, extension_size = struct.unpack_from(">ii", data, pos)
+        pos += 8 + extension_size
+        while True:
+            field_count = struct.unpack_from(">h", data, pos)[0]
+            pos += 2
+            if field_count == -1:
+                return rows
+            if field_count != len(columns):
+                raise ValueError(f"Ligne à {field_count} colonnes au lieu de {len(columns)} dans l'export")
+            row = []
+            for kind in kinds:
+                size = struct.unpack_from(">i", data, pos)[0]
+                pos += 4
+                if size == -1:
+                    row.append(None)
+                    continue
+                row.append(_decode_copy_value(kind, data[pos:pos + size]))
+                pos += size
+            rows.append(tuple(row))
+    except struct.error:
+        raise ValueError("Fichier d'export tronqué")
+
+def _read_export_header(source):
+    """Lire l'en-tête de la table suivante, ou None en fin de fichier"""
+    prefix = source.read(2)
+    if not prefix:
+        return None
+    if len(prefix) != 2:
+        raise ValueError("Fichier d'export tronqué")
+    table = _read_exact(source, struct.unpack(">H", prefix)[0]).decode()
+    columns = _read_exact(source, struct.unpack(">H", _read_exact(source, 2))[0]).decode().split(",")
+    return table, columns
+
+class DatabaseBusyError(Exception):
+    """Levée quand le pool est saturé: l'appelant doit demander de réessayer"""
+
+def _default_config() -> Dict[str, Any]:
+    return {
+        "category_name": "TICKETS",
+        "staff_role_id": None,
+        "ticket_message": DEFAULT_TICKET_MESSAGE,
+        "status_channel_id": None,
+        "inactivity_timeout_hours": None
+    }
+
+def _config_from_row(row) -> Dict[str, Any]:
+    return {
+        "category_name": row["category_name"],
+        "staff_role_id": row["staff_role_id"],
+        "ticket_message": row["ticket_message"],
+        "status_channel_id": row["status_channel_id"],
+        "inactivity_timeout_hours": row["inactivity_timeout_hours"]
+    }
+
+# ----- Interface commune -----
+class Storage:
+    """Interface de stockage: chaque backend implémente toutes ces méthodes.
+
+    Les horodatages `created_at` renvoyés par les méthodes de chargement et par
+    `fetch_table` sont des entiers (secondes depuis l'epoch), quel que soit le backend.
+    PostgreSQL les stocke en TIMESTAMP sans fuseau, interprété comme UTC.
+    """
+
+    name = "abstract"
+
+    async def init(self):
+        """Ouvrir les connexions et créer les tables si nécessaire"""
+        raise NotImplementedError
+
+    async def close(self):
+        """Fermer les connexions"""
+        raise NotImplementedError
+
+    # Configuration des serveurs
+    async def get_server_config(self, guild_id: int) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def update_server_config(self, guild_id: int, updates: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def list_status_channels(self) -> List[Dict[str, int]]:
+        """Lister les serveurs ayant un salon de status configuré"""
+        raise NotImplementedError
+
+    # Messages avec bouton d'ouverture
+    async def add_ticket_message(self, guild_id: int, message_id: int, channel_id: int):
+        raise NotImplementedError
+
+    async def remove_ticket_message(self, guild_id: int, message_id: int):
+        raise NotImplementedError
+
+    async def load_ticket_messages(self) -> Dict[int, Dict[int, int]]:
+        raise NotImplementedError
+
+    # Tickets ouverts
+    async def remove_open_ticket(self, user_id: int, guild_id: int) -> bool:
+        """Supprimer un ticket ouvert, renvoie True si une ligne a été supprimée"""
+        raise NotImplementedError
+
+    async def record_ticket_opened(self, user_id: int, channel_id: int, guild_id: int,
+                                   close_message_id: int, now: int):
+        """Écrire le ticket et son bouton de fermeture dans une seule transaction"""
+        raise NotImplementedError
+
+    async def record_ticket_closed(self, channel_id: int) -> Dict[str, Any]:
+        """Supprimer le ticket et ses boutons de fermeture dans une seule transaction.
+
+        Renvoie user_id, guild_id et created_at du ticket (None si aucun) et la liste
+        close_message_ids des boutons supprimés.
+        """
+        raise NotImplementedError
+
+    async def save_ticket_activity(self, activity: Dict[int, int]):
+        raise NotImplementedError
+
+    async def find_inactive_tickets(self, now: int, limit: int) -> List[Dict[str, int]]:
+        raise NotImplementedError
+
+    async def get_user_open_ticket(self, user_id: int, guild_id: int) -> Optional[int]:
+        raise NotImplementedError
+
+    async def load_open_tickets(self) -> Dict[str, Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def load_guild_open_tickets(self, guild_id: int) -> List[Dict[str, int]]:
+        raise NotImplementedError
+
+    # Boutons de fermeture
+    async def load_close_button_messages(self) -> Dict[int, Dict[str, int]]:
+        raise NotImplementedError
+
+    # Messages de status
+    async def save_status_message(self, guild_id: int, message_id: int, channel_id: int):
+        raise NotImplementedError
+
+    async def load_status_messages(self) -> Dict[int, Dict[str, int]]:
+        raise NotImplementedError
+
+    async def remove_status_message(self, guild_id: int):
+        raise NotImplementedError
+
+    # Statistiques (un document JSON par serveur)
+    async def load_ticket_stats(self, guild_ids: Optional[List[int]] = None) -> Dict[int, str]:
+        """Lire les statistiques des serveurs donnés (tous si None)"""
+        raise NotImplementedError
+
+    async def save_ticket_stats(self, stats: Dict[int, str], now: int):
+        raise NotImplementedError
+
+    # Métadonnées du bot (clé -> valeur)
+    async def get_metadata(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def set_metadata(self, key: str, value: str):
+        raise NotImplementedError
+
+    # Export/import en masse par serveur
+    async def export_guilds(self, output, guild_ids: Optional[List[int]] = None) -> Dict[str, int]:
+        """Écrire les données des serveurs (tous si None) dans un fichier binaire ouvert"""
+        raise NotImplementedError
+
+    async def import_guilds(self, source, guild_ids: Optional[List[int]] = None) -> Dict[str, int]:
+        """Importer un fichier d'export (idempotent), limité aux serveurs donnés si précisés"""
+        raise NotImplementedError
+
+    # Migration
+    async def fetch_table(self, table: str) -> List[Dict[str, Any]]:
+        """Lire toutes les lignes d'une table de TABLES"""
+        raise NotImplementedError
+
+    async def upsert_rows(self, table: str, rows: List[Dict[str, Any]]):
+        """Insérer ou remplacer des lignes lues par fetch_table"""
+        raise NotImplementedError
+
+# ----- Backend PostgreSQL -----
+# Dimensionnement du pool et délais d'attente (en secondes)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "5"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+# Nombre maximal de tâches en attente d'une connexion avant de refuser immédiatement
+DB_MAX_WAITERS = int(os.getenv("DB_MAX_WAITERS", str(DB_POOL_MAX_SIZE * 2)))
+
+# Journal des requêtes lentes: seuil (ms), proportion des requêtes lentes analysées par
+# EXPLAIN (ANALYZE, BUFFERS), et délai minimal entre deux analyses d'une même requête
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", "0.1"))
+SLOW_QUERY_EXPLAIN_COOLDOWN = float(os.getenv("SLOW_QUERY_EXPLAIN_COOLDOWN", "600"))
+
+def describe_params(args) -> str:
+    """Forme des paramètres (types et tailles) sans leurs valeurs"""
+    parts = []
+    for value in args:
+        if isinstance(value, (list, tuple)):
+            parts.append(f"{type(value).__name__}[{len(value)}]")
+        elif isinstance(value, str):
+            parts.append(f"str({len(value)})")
+        else:
+            parts.append(type(value).__name__)
+    return f"({', '.join(parts)})"
+
+def _short_query(query: str) -> str:
+    return " ".join(query.split())[:200]
+
+class _ExplainRollback(Exception):
+    """Annule la transaction ouverte autour d'un EXPLAIN ANALYZE"""
+
+class TimedConnection:
+    """Connexion asyncpg dont chaque requête est chronométrée.
+
+    Les autres attributs (transaction, copy_*, ...) sont délégués tels quels.
+    """
+
+    def __init__(self, conn, storage: "PostgresStorage"):
+        self.raw = conn
+        self._storage = storage
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    async def _timed(self, method: str, query: str, args, *call_args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = await getattr(self.raw, method)(query, *call_args, **kwargs)
+        except BaseException:
+            # Une requête en échec (ou expirée) est journalisée mais jamais rejouée par EXPLAIN
+            self._report(method, query, args, start, succeeded=False)
+            raise
+        self._report(method, query, args, start, succeeded=True)
+        return result
+
+    def _report(self, method: str, query: str, args, start: float, succeeded: bool):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms >= SLOW_QUERY_MS:
+            self._storage.report_slow_query(method, query, args, elapsed_ms, explain=succeeded)
+
+    async def execute(self, query: str, *args, **kwargs):
+        return await self._timed("execute", query, args, *args, **kwargs)
+
+    async def executemany(self, query: str, args, **kwargs):
+        args = list(args)
+        first = tuple(args[0]) if args else ()
+        return await self._timed("executemany", query, first, args, **kwargs)
+
+    async def fetch(self, query: str, *args, **kwargs):
+        return await self._timed("fetch", query, args, *args, **kwargs)
+
+    async def fetchrow(self, query: str, *args, **kwargs):
+        return await self._timed("fetchrow", query, args, *args, **kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs):
+        return await self._timed("fetchval", query, args, *args, **kwargs)
+
+class PostgresStorage(Storage):
+    name = "PostgreSQL"
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.pool = None
+        # Connexion déjà acquise par la tâche courante, réutilisée par les appels imbriqués
+        self._current_conn: contextvars.ContextVar = contextvars.ContextVar("current_conn", default=None)
+        self._pending_acquires = 0
+        self.slow_queries = 0
+        self._explained_at: Dict[str, float] = {}
+        self._explain_tasks = set()
+
+    def report_slow_query(self, method: str, query: str, args, elapsed_ms: float, explain: bool = True):
+        """Journaliser une requête lente et, par échantillonnage, capturer son plan"""
+        self.slow_queries += 1
+        status = "" if explain else ", en échec"
+        print(f"🐢 Requête lente ({elapsed_ms:.0f} ms, {method}{status}) params={describe_params(args)}: {_short_query(query)}")
+
+        if not explain or random.random() >= SLOW_QUERY_EXPLAIN_RATE:
+            return
+        if query.lstrip().split(None, 1)[0].upper() not in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH"):
+            return
+        now = time.monotonic()
+        if now - self._explained_at.get(query, -SLOW_QUERY_EXPLAIN_COOLDOWN) < SLOW_QUERY_EXPLAIN_COOLDOWN:
+            return
+        self._explained_at[query] = now
+
+        task = asyncio.create_task(self._explain(query, args))
+        self._explain_tasks.add(task)
+        task.add_done_callback(self._explain_tasks.discard)
+
+    async def _explain(self, query: str, args):
+        """Capturer le plan sur une connexion à part, dans une transaction annulée"""
+        # Ne pas prendre de connexion à une application déjà à court de connexions
+        if self.pool is None or self.pool.get_idle_size() == 0:
+            return
+        try:
+            async with self.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+                try:
+                    async with conn.transaction():
+                        rows = await conn.fetch(f"EXPLAIN (ANALYZE, BUFFERS) {query}", *args)
+                        raise _ExplainRollback()
+                except _ExplainRollback:
+                    pass
+            plan = "\n".join(f"    {row[0]}" for row in rows)
+            print(f"🔍 Plan de la requête lente: {_short_query(query)}\n{plan}")
+        except Exception as e:
+            print(f"Impossible de capturer le plan de la requête lente: {e}")
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Acquérir une connexion du pool, ou réutiliser celle de l'appelant.
+
+        Un appel fait alors qu'une connexion est déjà tenue réutilise cette
+        connexion au lieu d'en prendre une seconde, ce qui évite l'épuisement
+        du pool en rafale.
+        """
+        conn = self._current_conn.get()
+        if conn is not None:
+            yield conn
+            return
+
+        if self._pending_acquires >= DB_MAX_WAITERS:
+            raise DatabaseBusyError("Pool de connexions saturé")
+
+        self._pending_acquires += 1
+        try:
+            raw_conn = await self.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise DatabaseBusyError("Délai d'acquisition d'une connexion dépassé")
+        finally:
+            self._pending_acquires -= 1
+
+        conn = TimedConnection(raw_conn, self)
+        token = self._current_conn.set(conn)
+        try:
+            yield conn
+        finally:
+            self._current_conn.reset(token)
+            await self.pool.release(raw_conn)
+
+    async def init(self):
+        self.pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            command_timeout=DB_COMMAND_TIMEOUT
+        )
+
+        # Créer les tables si elles n'existent pas
+        async with self.acquire() as conn:
+            # Table pour la configuration des serveurs
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS servers_config (
+                    guild_id BIGINT PRIMARY KEY,
+                    category_name VARCHAR(255) DEFAULT 'TICKETS',
+                    staff_role_id BIGINT,
+                    ticket_message TEXT DEFAULT '{user} Merci d''avoir ouvert un ticket. Un membre du staff va te répondre.',
+                    status_channel_id BIGINT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Table pour les messages avec boutons de tickets
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS ticket_messages (
+                    message_id BIGINT,
+                    guild_id BIGINT,
+                    channel_id BIGINT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (message_id, guild_id)
+                )
+            ''')
+
+            # Table pour les tickets ouverts
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS open_tickets (
+                    user_id BIGINT,
+                    guild_id BIGINT,
+                    ticket_channel_id BIGINT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_id, guild_id)
+                )
+            ''')
+
+            # Table pour les messages de fermeture
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS close_button_messages (
+                    message_id BIGINT PRIMARY KEY,
+                    channel_id BIGINT,
+                    guild_id BIGINT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Table pour les messages de status
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS status_messages (
+                    guild_id BIGINT PRIMARY KEY,
+                    message_id BIGINT,
+                    channel_id BIGINT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Colonnes pour la fermeture automatique des tickets inactifs
+            await conn.execute('''
+                ALTER TABLE servers_config ADD COLUMN IF NOT EXISTS inactivity_timeout_hours INTEGER
+            ''')
+            await conn.execute('''
+                ALTER TABLE open_tickets ADD COLUMN IF NOT EXISTS last_activity_ts BIGINT
+            ''')
+
+            # Table pour les statistiques agrégées par serveur
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS ticket_stats (
+                    guild_id BIGINT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated_at BIGINT
+                )
+            ''')
+
+            # Table pour les métadonnées du bot (empreinte des commandes, ...)
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS bot_metadata (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            ''')
+
+            # Index pour la fermeture (par salon) et le nettoyage (par serveur)
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS open_tickets_channel_idx ON open_tickets (ticket_channel_id)
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS open_tickets_guild_idx ON open_tickets (guild_id)
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS close_button_messages_channel_idx ON close_button_messages (channel_id)
+            ''')
+
+    async def close(self):
+        for task in list(self._explain_tasks):
+            task.cancel()
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+
+    async def get_server_config(self, guild_id: int) -> Dict[str, Any]:
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT * FROM servers_config WHERE guild_id = $1", guild_id
+            )
+
+            if row:
+                return _config_from_row(row)
+
+            # Créer la configuration par défaut
+            default_config = _default_config()
+            await conn.execute('''
+                INSERT INTO servers_config (guild_id, category_name, staff_role_id, ticket_message, status_channel_id)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (guild_id) DO NOTHING
+            ''', guild_id, default_config["category_name"], default_config["staff_role_id"],
+                default_config["ticket_message"], default_config["status_channel_id"])
+
+            return default_config
+
+    async def update_server_config(self, guild_id: int, updates: Dict[str, Any]):
+        async with self.acquire() as conn:
+            # Créer la configuration par défaut si elle n'existe pas
+            await conn.execute('''
+                INSERT INTO servers_config (guild_id, category_name, staff_role_id, ticket_message, status_channel_id)
+                VALUES ($1, 'TICKETS', NULL, $2, NULL)
+                ON CONFLICT (guild_id) DO NOTHING
+            ''', guild_id, DEFAULT_TICKET_MESSAGE)
+
+            # Mettre à jour les champs spécifiés
+            for key, value in updates.items():
+                if key in CONFIG_FIELDS:
+                    await conn.execute(f'''
+                        UPDATE servers_config
+                        SET {key} = $1
+                        WHERE guild_id = $2
+                    ''', value, guild_id)
+
+    async def list_status_channels(self) -> List[Dict[str, int]]:
+        async with self.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT guild_id, status_channel_id FROM servers_config
+                WHERE status_channel_id IS NOT NULL
+            ''')
+            return [dict(row) for row in rows]
+
+    async def add_ticket_message(self, guild_id: int, message_id: int, channel_id: int):
+        async with self.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO ticket_messages (message_id, guild_id, channel_id)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (message_id, guild_id) DO UPDATE SET channel_id = $3
+            ''', message_id, guild_id, channel_id)
+
+    async def remove_ticket_message(self, guild_id: int, message_id: int):
+        async with self.acquire() as conn:
+            await conn.execute('''
+                DELETE FROM ticket_messages
+                WHERE guild_id = $1 AND message_id = $2
+            ''', guild_id, message_id)
+
+    async def load_ticket_messages(self) -> Dict[int, Dict[int, int]]:
+        async with self.acquire() as conn:
+            rows = await conn.fetch("SELECT guild_id, message_id, channel_id FROM ticket_messages")
+
+        result = {}
+        for row in rows:
+            result.setdefault(row["guild_id"], {})[row["message_id"]] = row["channel_id"]
+        return result
+
+    async def remove_open_ticket(self, user_id: int, guild_id: int) -> bool:
+        async with self.acquire() as conn:
+            result = await conn.execute('''
+                DELETE FROM open_tickets
+                WHERE user_id = $1 AND guild_id = $2
+            ''', user_id, guild_id)
+            return result == "DELETE 1"
+
+    async def record_ticket_opened(self, user_id: int, channel_id: int, guild_id: int,
+                                   close_message_id: int, now: int):
+        # Une seule instruction (CTE), donc une seule transaction et un seul aller-retour.
+        # created_at est écrit en UTC depuis `now`, indépendamment du fuseau de la session
+        async with self.acquire() as conn:
+            await conn.execute('''
+                WITH ticket AS (
+                    INSERT INTO open_tickets (user_id, guild_id, ticket_channel_id, created_at, last_activity_ts)
+                    VALUES ($1, $2, $3, to_timestamp($5::BIGINT) AT TIME ZONE 'UTC', $5)
+                    ON CONFLICT (user_id, guild_id)
+                    DO UPDATE SET ticket_channel_id = $3, created_at = EXCLUDED.created_at, last_activity_ts = $5
+                )
+                INSERT INTO close_button_messages (message_id, channel_id, guild_id)
+                VALUES ($4, $3, $2)
+                ON CONFLICT (message_id)
+                DO UPDATE SET channel_id = $3, guild_id = $2
+            ''', user_id, guild_id, channel_id, close_message_id, now)
+
+    async def record_ticket_closed(self, channel_id: int) -> Dict[str, Any]:
+        async with self.acquire() as conn:
+            row = await conn.fetchrow('''
+                WITH ticket AS (
+                    DELETE FROM open_tickets WHERE ticket_channel_id = $1
+                    RETURNING user_id, guild_id, created_at
+                ), buttons AS (
+                    DELETE FROM close_button_messages WHERE channel_id = $1
+                    RETURNING message_id
+                )
+                SELECT ticket.user_id, ticket.guild_id,
+                       EXTRACT(EPOCH FROM ticket.created_at)::BIGINT AS created_at,
+                       ARRAY(SELECT message_id FROM buttons) AS close_message_ids
+                FROM (SELECT 1) AS one LEFT JOIN ticket ON TRUE
+            ''', channel_id)
+
+        return {
+            "user_id": row["user_id"],
+            "guild_id": row["guild_id"],
+            "created_at": row["created_at"],
+            "close_message_ids": list(row["close_message_ids"])
+        }
+
+    async def save_ticket_activity(self, activity: Dict[int, int]):
+        async with self.acquire() as conn:
+            await conn.execute('''
+                UPDATE open_tickets AS t
+                SET last_activity_ts = GREATEST(COALESCE(t.last_activity_ts, 0), a.ts)
+                FROM unnest($1::BIGINT[], $2::BIGINT[]) AS a(channel_id, ts)
+                WHERE t.ticket_channel_id = a.channel_id
+            ''', list(activity.keys()), list(activity.values()))
+
+    async def find_inactive_tickets(self, now: int, limit: int) -> List[Dict[str, int]]:
+        async with self.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT t.user_id, t.guild_id, t.ticket_channel_id
+                FROM open_tickets t
+                JOIN servers_config c ON c.guild_id = t.guild_id
+                WHERE c.inactivity_timeout_hours IS NOT NULL
+                  AND COALESCE(t.last_activity_ts, EXTRACT(EPOCH FROM t.created_at)::BIGINT)
+                      < $1::BIGINT - c.inactivity_timeout_hours * 3600
+                LIMIT $2
+            ''', now, limit)
+            return [dict(row) for row in rows]
+
+    async def get_user_open_ticket(self, user_id: int, guild_id: int) -> Optional[int]:
+        async with self.acquire() as conn:
+            return await conn.fetchval('''
+                SELECT ticket_channel_id FROM open_tickets
+                WHERE user_id = $1 AND guild_id = $2
+            ''', user_id, guild_id)
+
+    async def load_open_tickets(self) -> Dict[str, Dict[str, Any]]:
+        async with self.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT user_id, guild_id, ticket_channel_id, EXTRACT(EPOCH FROM created_at)::BIGINT AS created_at
+                FROM open_tickets
+            ''')
+
+        result = {}
+        for row in rows:
+            key = f"{row['user_id']}_{row['guild_id']}"
+            result[key] = {
+                "user_id": row["user_id"],
+                "guild_id": row["guild_id"],
+                "ticket_channel_id": row["ticket_channel_id"],
+                "created_at": row["created_at"]
+            }
+        return result
+
+    async def load_guild_open_tickets(self, guild_id: int) -> List[Dict[str, int]]:
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT user_id, guild_id, ticket_channel_id FROM open_tickets WHERE guild_id = $1", guild_id
+            )
+            return [dict(row) for row in rows]
+
+    async def load_close_button_messages(self) -> Dict[int, Dict[str, int]]:
+        async with self.acquire() as conn:
+            rows = await conn.fetch("SELECT message_id, channel_id, guild_id FROM close_button_messages")
+
+        return {
+            row["message_id"]: {"channel_id": row["channel_id"], "guild_id": row["guild_id"]}
+            for row in rows
+        }
+
+    async def save_status_message(self, guild_id: int, message_id: int, channel_id: int):
+        async with self.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO status_messages (guild_id, message_id, channel_id)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (guild_id)
+                DO UPDATE SET message_id = $2, channel_id = $3
+            ''', guild_id, message_id, channel_id)
+
+    async def load_status_messages(self) -> Dict[int, Dict[str, int]]:
+        async with self.acquire() as conn:
+            rows = await conn.fetch("SELECT guild_id, message_id, channel_id FROM status_messages")
+
+        return {
+            row["guild_id"]: {"message_id": row["message_id"], "channel_id": row["channel_id"]}
+            for row in rows
+        }
+
+    async def remove_status_message(self, guild_id: int):
+        async with self.acquire() as conn:
+            await conn.execute('''
+                DELETE FROM status_messages WHERE guild_id = $1
+            ''', guild_id)
+
+    async def load_ticket_stats(self, guild_ids: Optional[List[int]] = None) -> Dict[int, str]:
+        async with self.acquire() as conn:
+            if guild_ids is None:
+                rows = await conn.fetch("SELECT guild_id, data FROM ticket_stats")
+            else:
+                rows = await conn.fetch(
+                    "SELECT guild_id, data FROM ticket_stats WHERE guild_id = ANY($1::BIGINT[])", list(guild_ids)
+                )
+        return {row["guild_id"]: row["data"] for row in rows}
+
+    async def save_ticket_stats(self, stats: Dict[int, str], now: int):
+        async with self.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO ticket_stats (guild_id, data, updated_at)
+                SELECT guild_id, data, $3 FROM unnest($1::BIGINT[], $2::TEXT[]) AS s(guild_id, data)
+                ON CONFLICT (guild_id)
+                DO UPDATE SET data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
+            ''', list(stats.keys()), list(stats.values()), now)
+
+    async def get_metadata(self, key: str) -> Optional[str]:
+        async with self.acquire() as conn:
+            return await conn.fetchval("SELECT value FROM bot_metadata WHERE key = $1", key)
+
+    async def set_metadata(self, key: str, value: str):
+        async with self.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO bot_metadata (key, value) VALUES ($1, $2)
+                ON CONFLICT (key) DO UPDATE SET value = $2
+            ''', key, value)
+
+    async def export_guilds(self, output, guild_ids: Optional[List[int]] = None) -> Dict[str, int]:
+        where = "" if guild_ids is None else "WHERE guild_id = ANY($1::BIGINT[])"
+        args = () if guild_ids is None else (list(guild_ids),)
+
+        async def write_chunk(chunk: bytes):
+            output.write(struct.pack(">I", len(chunk)))
+            output.write(chunk)
+
+        counts = {}
+        output.write(EXPORT_MAGIC)
+        async with self.acquire() as conn:
+            # Instantané cohérent entre toutes les tables exportées
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                for table in EXPORT_TABLES:
+                    columns = TABLES[table]["columns"]
+                    _write_export_header(output, table, columns)
+                    status = await conn.copy_from_query(
+                        f"SELECT {', '.join(columns)} FROM {table} {where}", *args,
+                        output=write_chunk, format="binary"
+                    )
+                    output.write(struct.pack(">I", 0))
+                    counts[table] = int(status.split()[-1])
+        return counts
+
+    async def import_guilds(self, source, guild_ids: Optional[List[int]] = None) -> Dict[str, int]:
+        if source.read(len(EXPORT_MAGIC)) != EXPORT_MAGIC:
+            raise ValueError("Ce fichier n'est pas un export du bot tickets")
+
+        where = "" if guild_ids is None else "WHERE guild_id = ANY($1::BIGINT[])"
+        args = () if guild_ids is None else (list(guild_ids),)
+
+        async def read_chunks():
+            for chunk in _read_export_chunks(source):
+                yield chunk
+
+        counts = {}
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                while True:
+                    header = _read_export_header(source)
+                    if header is None:
+                        break
+                    table, columns = header
+                    if table not in EXPORT_TABLES or columns != TABLES[table]["columns"]:
+                        raise ValueError(f"Table inattendue dans l'export: {table} ({', '.join(columns)})")
+
+                    # Charger dans une table temporaire par COPY, puis fusionner: réimporter
+                    # le même fichier remplace les lignes au lieu de les dupliquer
+                    staging = f"import_{table}"
+                    await conn.execute(f"CREATE TEMP TABLE {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+                    await conn.copy_to_table(staging, source=read_chunks(), columns=columns, format="binary")
+
+                    key = TABLES[table]["key"]
+                    updates = [column for column in columns if column not in key]
+                    status = await conn.execute(f'''
+                        INSERT INTO {table} ({', '.join(columns)})
+                        SELECT {', '.join(columns)} FROM {staging} {where}
+                        ON CONFLICT ({', '.join(key)})
+                        DO UPDATE SET {', '.join(f"{column} = EXCLUDED.{column}" for column in updates)}
+                    ''', *args)
+                    counts[table] = int(status.split()[-1])
+        return counts
+
+    async def fetch_table(self, table: str) -> List[Dict[str, Any]]:
+        columns = TABLES[table]["columns"]
+        async with self.acquire() as conn:
+            rows = await conn.fetch(f"SELECT {', '.join(columns)} FROM {table}")
+
+        result = []
+        for row in rows:
+            data = dict(row)
+            if data.get("created_at") is not None:
+                data["created_at"] = int(data["created_at"].replace(tzinfo=timezone.utc).timestamp())
+            result.append(data)
+        return result
+
+    async def upsert_rows(self, table: str, rows: List[Dict[str, Any]]):
+        if not rows:
+            return
+        columns = TABLES[table]["columns"]
+        key = TABLES[table]["key"]
+        updates = [column for column in columns if column not in key]
+        placeholders = ", ".join(f"${i}" for i in range(1, len(columns) + 1))
+        query = f'''
+            INSERT INTO {table} ({', '.join(columns)})
+            VALUES ({placeholders})
+            ON CONFLICT ({', '.join(key)})
+            DO UPDATE SET {', '.join(f"{column} = EXCLUDED.{column}" for column in updates)}
+        '''
+
+        records = []
+        for row in rows:
+            values = []
+            for column in columns:
+                value = row.get(column)
+                if column == "created_at" and value is not None:
+                    value = datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+                values.append(value)
+            records.append(values)
+
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany(query, records)
+
+# ----- Backend SQLite embarqué -----
+class SQLiteStorage(Storage):
+    """Stockage local dans un fichier SQLite en mode WAL.
+
+    Toutes les requêtes passent par un unique thread dédié qui possède la
+    connexion: les accès sont sérialisés sans verrou et ne bloquent jamais la
+    boucle asyncio. Pensé pour une instance unique (pas de partage multi-processus).
+    """
+
+    name = "SQLite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _fetchall(self, query: str, params=()) -> List[sqlite3.Row]:
+        return self._conn.execute(query, params).fetchall()
+
+    def _fetchone(self, query: str, params=()) -> Optional[sqlite3.Row]:
+        return self._conn.execute(query, params).fetchone()
+
+    def _write(self, query: str, params=()) -> int:
+        with self._conn:
+            return self._conn.execute(query, params).rowcount
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+        now = "(CAST(strftime('%s', 'now') AS INTEGER))"
+        with self._conn:
+            self._conn.executescript(f'''
+                CREATE TABLE IF NOT EXISTS servers_config (
+                    guild_id INTEGER PRIMARY KEY,
+                    category_name TEXT DEFAULT 'TICKETS',
+                    staff_role_id INTEGER,
+                    ticket_message TEXT DEFAULT '{{user}} Merci d''avoir ouvert un ticket. Un membre du staff va te répondre.',
+                    status_channel_id INTEGER,
+                    inactivity_timeout_hours INTEGER,
+                    created_at INTEGER DEFAULT {now}
+                );
+                CREATE TABLE IF NOT EXISTS ticket_messages (
+                    message_id INTEGER,
+                    guild_id INTEGER,
+                    channel_id INTEGER,
+                    created_at INTEGER DEFAULT {now},
+                    PRIMARY KEY (message_id, guild_id)
+                );
+                CREATE TABLE IF NOT EXISTS open_tickets (
+                    user_id INTEGER,
+                    guild_id INTEGER,
+                    ticket_channel_id INTEGER,
+                    created_at INTEGER DEFAULT {now},
+                    last_activity_ts INTEGER,
+                    PRIMARY KEY (user_id, guild_id)
+                );
+                CREATE TABLE IF NOT EXISTS close_button_messages (
+                    message_id INTEGER PRIMARY KEY,
+                    channel_id INTEGER,
+                    guild_id INTEGER,
+                    created_at INTEGER DEFAULT {now}
+                );
+                CREATE TABLE IF NOT EXISTS status_messages (
+                    guild_id INTEGER PRIMARY KEY,
+                    message_id INTEGER,
+                    channel_id INTEGER,
+                    created_at INTEGER DEFAULT {now}
+                );
+                CREATE TABLE IF NOT EXISTS ticket_stats (
+                    guild_id INTEGER PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated_at INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS bot_metadata (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE INDEX IF NOT EXISTS open_tickets_channel_idx ON open_tickets (ticket_channel_id);
+                CREATE INDEX IF NOT EXISTS open_tickets_guild_idx ON open_tickets (guild_id);
+                CREATE INDEX IF NOT EXISTS close_button_messages_channel_idx ON close_button_messages (channel_id);
+            ''')
+
+    async def init(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        await self._run(self._open)
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def get_server_config(self, guild_id: int) -> Dict[str, Any]:
+        def run():
+            row = self._fetchone("SELECT * FROM servers_config WHERE guild_id = ?", (guild_id,))
+            if row:
+                return _config_from_row(row)
+            default_config = _default_config()
+            self._write('''
+                INSERT INTO servers_config (guild_id, category_name, ticket_message)
+                VALUES (?, ?, ?)
+                ON CONFLICT (guild_id) DO NOTHING
+            ''', (guild_id, default_config["category_name"], default_config["ticket_message"]))
+            return default_config
+        return await self._run(run)
+
+    async def update_server_config(self, guild_id: int, updates: Dict[str, Any]):
+        def run():
+            with self._conn:
+                self._conn.execute('''
+                    INSERT INTO servers_config (guild_id, category_name, ticket_message)
+                    VALUES (?, 'TICKETS', ?)
+                    ON CONFLICT (guild_id) DO NOTHING
+                ''', (guild_id, DEFAULT_TICKET_MESSAGE))
+                for key, value in updates.items():
+                    if key in CONFIG_FIELDS:
+                        self._conn.execute(
+                            f"UPDATE servers_config SET {key} = ? WHERE guild_id = ?", (value, guild_id)
+                        )
+        await self._run(run)
+
+    async def list_status_channels(self) -> List[Dict[str, int]]:
+        rows = await self._run(self._fetchall, '''
+            SELECT guild_id, status_channel_id FROM servers_config
+            WHERE status_channel_id IS NOT NULL
+        ''')
+        return [dict(row) for row in rows]
+
+    async def add_ticket_message(self, guild_id: int, message_id: int, channel_id: int):
+        await self._run(self._write, '''
+            INSERT INTO ticket_messages (message_id, guild_id, channel_id)
+            VALUES (?, ?, ?)
+            ON CONFLICT (message_id, guild_id) DO UPDATE SET channel_id = excluded.channel_id
+        ''', (message_id, guild_id, channel_id))
+
+    async def remove_ticket_message(self, guild_id: int, message_id: int):
+        await self._run(self._write, '''
+            DELETE FROM ticket_messages WHERE guild_id = ? AND message_id = ?
+        ''', (guild_id, message_id))
+
+    async def load_ticket_messages(self) -> Dict[int, Dict[int, int]]:
+        rows = await self._run(self._fetchall, "SELECT guild_id, message_id, channel_id FROM ticket_messages")
+        result = {}
+        for row in rows:
+            result.setdefault(row["guild_id"], {})[row["message_id"]] = row["channel_id"]
+        return result
+
+    async def remove_open_ticket(self, user_id: int, guild_id: int) -> bool:
+        deleted = await self._run(self._write, '''
+            DELETE FROM open_tickets WHERE user_id = ? AND guild_id = ?
+        ''', (user_id, guild_id))
+        return deleted == 1
+
+    async def record_ticket_opened(self, user_id: int, channel_id: int, guild_id: int,
+                                   close_message_id: int, now: int):
+        def run():
+            with self._conn:
+                self._conn.execute('''
+                    INSERT INTO open_tickets (user_id, guild_id, ticket_channel_id, created_at, last_activity_ts)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (user_id, guild_id)
+                    DO UPDATE SET ticket_channel_id = excluded.ticket_channel_id,
+                                  created_at = excluded.created_at,
+                                  last_activity_ts = excluded.last_activity_ts
+                ''', (user_id, guild_id, channel_id, now, now))
+                self._conn.execute('''
+                    INSERT INTO close_button_messages (message_id, channel_id, guild_id)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (message_id)
+                    DO UPDATE SET channel_id = excluded.channel_id, guild_id = excluded.guild_id
+                ''', (close_message_id, channel_id, guild_id))
+        await self._run(run)
+
+    async def record_ticket_closed(self, channel_id: int) -> Dict[str, Any]:
+        def run():
+            with self._conn:
+                ticket = self._conn.execute(
+                    "SELECT user_id, guild_id, created_at FROM open_tickets WHERE ticket_channel_id = ?", (channel_id,)
+                ).fetchone()
+                buttons = self._conn.execute(
+                    "SELECT message_id FROM close_button_messages WHERE channel_id = ?", (channel_id,)
+                ).fetchall()
+                self._conn.execute("DELETE FROM open_tickets WHERE ticket_channel_id = ?", (channel_id,))
+                self._conn.execute("DELETE FROM close_button_messages WHERE channel_id = ?", (channel_id,))
+            return {
+                "user_id": ticket["user_id"] if ticket else None,
+                "guild_id": ticket["guild_id"] if ticket else None,
+                "created_at": ticket["created_at"] if ticket else None,
+                "close_message_ids": [row["message_id"] for row in buttons]
+            }
+        return await self._run(run)
+
+    async def save_ticket_activity(self, activity: Dict[int, int]):
+        def run():
+            with self._conn:
+                self._conn.executemany('''
+                    UPDATE open_tickets
+                    SET last_activity_ts = MAX(COALESCE(last_activity_ts, 0), ?)
+                    WHERE ticket_channel_id = ?
+                ''', [(ts, channel_id) for channel_id, ts in activity.items()])
+        await self._run(run)
+
+    async def find_inactive_tickets(self, now: int, limit: int) -> List[Dict[str, int]]:
+        rows = await self._run(self._fetchall, '''
+            SELECT t.user_id, t.guild_id, t.ticket_channel_id
+            FROM open_tickets t
+            JOIN servers_config c ON c.guild_id = t.guild_id
+            WHERE c.inactivity_timeout_hours IS NOT NULL
+              AND COALESCE(t.last_activity_ts, t.created_at) < ? - c.inactivity_timeout_hours * 3600
+            LIMIT ?
+        ''', (now, limit))
+        return [dict(row) for row in rows]
+
+    async def get_user_open_ticket(self, user_id: int, guild_id: int) -> Optional[int]:
+        row = await self._run(self._fetchone, '''
+            SELECT ticket_channel_id FROM open_tickets WHERE user_id = ? AND guild_id = ?
+        ''', (user_id, guild_id))
+        return row["ticket_channel_id"] if row else None
+
+    async def load_open_tickets(self) -> Dict[str, Dict[str, Any]]:
+        rows = await self._run(self._fetchall, "SELECT user_id, guild_id, ticket_channel_id, created_at FROM open_tickets")
+        return {
+            f"{row['user_id']}_{row['guild_id']}": {
+                "user_id": row["user_id"],
+                "guild_id": row["guild_id"],
+                "ticket_channel_id": row["ticket_channel_id"],
+                "created_at": row["created_at"]
+            }
+            for row in rows
+        }
+
+    async def load_guild_open_tickets(self, guild_id: int) -> List[Dict[str, int]]:
+        rows = await self._run(self._fetchall, '''
+            SELECT user_id, guild_id, ticket_channel_id FROM open_tickets WHERE guild_id = ?
+        ''', (guild_id,))
+        return [dict(row) for row in rows]
+
+    async def load_close_button_messages(self) -> Dict[int, Dict[str, int]]:
+        rows = await self._run(self._fetchall, "SELECT message_id, channel_id, guild_id FROM close_button_messages")
+        return {
+            row["message_id"]: {"channel_id": row["channel_id"], "guild_id": row["guild_id"]}
+            for row in rows
+        }
+
+    async def save_status_message(self, guild_id: int, message_id: int, channel_id: int):
+        await self._run(self._write, '''
+            INSERT INTO status_messages (guild_id, message_id, channel_id)
+            VALUES (?, ?, ?)
+            ON CONFLICT (guild_id)
+            DO UPDATE SET message_id = excluded.message_id, channel_id = excluded.channel_id
+        ''', (guild_id, message_id, channel_id))
+
+    async def load_status_messages(self) -> Dict[int, Dict[str, int]]:
+        rows = await self._run(self._fetchall, "SELECT guild_id, message_id, channel_id FROM status_messages")
+        return {
+            row["guild_id"]: {"message_id": row["message_id"], "channel_id": row["channel_id"]}
+            for row in rows
+        }
+
+    async def remove_status_message(self, guild_id: int):
+        await self._run(self._write, "DELETE FROM status_messages WHERE guild_id = ?", (guild_id,))
+
+    async def load_ticket_stats(self, guild_ids: Optional[List[int]] = None) -> Dict[int, str]:
+        query = "SELECT guild_id, data FROM ticket_stats"
+        params = ()
+        if guild_ids is not None:
+            query += f" WHERE guild_id IN ({', '.join('?' for _ in guild_ids)})"
+            params = tuple(guild_ids)
+        rows = await self._run(self._fetchall, query, params)
+        return {row["guild_id"]: row["data"] for row in rows}
+
+    async def save_ticket_stats(self, stats: Dict[int, str], now: int):
+        def run():
+            with self._conn:
+                self._conn.executemany('''
+                    INSERT INTO ticket_stats (guild_id, data, updated_at)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (guild_id)
+                    DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+                ''', [(guild_id, data, now) for guild_id, data in stats.items()])
+        await self._run(run)
+
+    async def get_metadata(self, key: str) -> Optional[str]:
+        row = await self._run(self._fetchone, "SELECT value FROM bot_metadata WHERE key = ?", (key,))
+        return row["value"] if row else None
+
+    async def set_metadata(self, key: str, value: str):
+        await self._run(self._write, '''
+            INSERT INTO bot_metadata (key, value) VALUES (?, ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value
+        ''', (key, value))
+
+    async def fetch_table(self, table: str) -> List[Dict[str, Any]]:
+        columns = TABLES[table]["columns"]
+        rows = await self._run(self._fetchall, f"SELECT {', '.join(columns)} FROM {table}")
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def _upsert_query(table: str) -> str:
+        columns = TABLES[table]["columns"]
+        key = TABLES[table]["key"]
+        updates = [column for column in columns if column not in key]
+        return f'''
+            INSERT INTO {table} ({', '.join(columns)})
+            VALUES ({', '.join('?' for _ in columns)})
+            ON CONFLICT ({', '.join(key)})
+            DO UPDATE SET {', '.join(f"{column} = excluded.{column}" for column in updates)}
+        '''
+
+    async def upsert_rows(self, table: str, rows: List[Dict[str, Any]]):
+        if not rows:
+            return
+        columns = TABLES[table]["columns"]
+        query = self._upsert_query(table)
+        records = [tuple(row.get(column) for column in columns) for row in rows]
+
+        def run():
+            with self._conn:
+                self._conn.executemany(query, records)
+        await self._run(run)
+
+    async def export_guilds(self, output, guild_ids: Optional[List[int]] = None) -> Dict[str, int]:
+        # Lecture ligne à ligne, encodée dans le même format que l'export PostgreSQL.
+        # Toutes les tables sont lues dans un seul passage du thread SQLite: l'export est cohérent
+        def run():
+            tables = {}
+            for table in EXPORT_TABLES:
+                query = f"SELECT {', '.join(TABLES[table]['columns'])} FROM {table}"
+                params = ()
+                if guild_ids is not None:
+                    query += f" WHERE guild_id IN ({', '.join('?' for _ in guild_ids)})"
+                    params = tuple(guild_ids)
+                tables[table] = [tuple(row) for row in self._conn.execute(query, params)]
+            return tables
+        tables = await self._run(run)
+
+        counts = {}
+        output.write(EXPORT_MAGIC)
+        for table, rows in tables.items():
+            _write_export_header(output, table, TABLES[table]["columns"])
+            chunk = _encode_copy_rows(TABLES[table]["columns"], rows)
+            output.write(struct.pack(">I", len(chunk)))
+            output.write(chunk)
+            output.write(struct.pack(">I", 0))
+            counts[table] = len(rows)
+        return counts
+
+    async def import_guilds(self, source, guild_ids: Optional[List[int]] = None) -> Dict[str, int]:
+        if source.read(len(EXPORT_MAGIC)) != EXPORT_MAGIC:
+            raise ValueError("Ce fichier n'est pas un export du bot tickets")
+
+        tables = []
+        while True:
+            header = _read_export_header(source)
+            if header is None:
+                break
+            table, columns = header
+            if table not in EXPORT_TABLES or columns != TABLES[table]["columns"]:
+                raise ValueError(f"Table inattendue dans l'export: {table} ({', '.join(columns)})")
+            rows = _decode_copy_rows(columns, b"".join(_read_export_chunks(source)))
+            if guild_ids is not None:
+                guild_index = columns.index("guild_id")
+                rows = [row for row in rows if row[guild_index] in guild_ids]
+            tables.append((table, rows))
+
+        # Upsert de toutes les tables dans une seule transaction: réimporter remplace les lignes
+        def run():
+            with self._conn:
+                for table, rows in tables:
+                    self._conn.executemany(self._upsert_query(table), rows)
+        await self._run(run)
+        return {table: len(rows) for table, rows in tables}
+
+# ----- Sélection du backend -----
+def create_storage(url: str) -> Storage:
+    """Créer le backend correspondant à l'URL (postgres://... ou sqlite:///chemin)"""
+    if url.startswith("sqlite:"):
+        path = url[len("sqlite:"):]
+        if path.startswith("//"):
+            path = path[3:] if path.startswith("///") else path[2:]
+        return SQLiteStorage(path or "tickets.db")
+    return PostgresStorage(url)
+
+# ----- Migration entre backends -----
+async def migrate(source_url: str, target_url: str):
+    """Copier toutes les tables d'un backend vers un autre (idempotent: upsert)"""
+    source = create_storage(source_url)
+    target = create_storage(target_url)
+    await source.init()
+    await target.init()
+    try:
+        for table in TABLES:
+            rows = await source.fetch_table(table)
+            await target.upsert_rows(table, rows)
+            print(f"✅ {table}: {len(rows)} ligne(s) copiée(s) de {source.name} vers {target.name}")
+    finally:
+        await source.close()
+        await target.close()
+
+# ----- Export/import en masse -----
+def _print_transfer(action: str, counts: Dict[str, int], elapsed: float):
+    total = sum(counts.values())
+    for table, count in counts.items():
+        print(f"✅ {table}: {count} ligne(s) {action}(s)")
+    rate = total / elapsed * 60 if elapsed > 0 else 0
+    print(f"Total: {total} ligne(s) en {elapsed:.2f}s ({rate:,.0f} lignes/min)")
+
+async def export_to_file(url: str, path: str, guild_ids: Optional[List[int]]):
+    """Exporter les serveurs donnés (tous si None) dans un fichier"""
+    storage = create_storage(url)
+    await storage.init()
+    try:
+        start = time.perf_counter()
+        with open(path, "wb") as output:
+            counts = await storage.export_guilds(output, guild_ids)
+        _print_transfer("exportée", counts, time.perf_counter() - start)
+    finally:
+        await storage.close()
+
+async def import_from_file(url: str, path: str, guild_ids: Optional[List[int]]):
+    """Importer un fichier d'export, limité aux serveurs donnés si précisés"""
+    storage = create_storage(url)
+    await storage.init()
+    try:
+        start = time.perf_counter()
+        with open(path, "rb") as source:
+            counts = await storage.import_guilds(source, guild_ids)
+        _print_transfer("importée", counts, time.perf_counter() - start)
+    finally:
+        await storage.close()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Outils de stockage du bot tickets")
+    commands_parser = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = commands_parser.add_parser("migrate", help="Copier les données d'un backend vers un autre")
+    migrate_parser.add_argument("source", help="URL source (postgres://... ou sqlite:///tickets.db)")
+    migrate_parser.add_argument("target", help="URL cible (postgres://... ou sqlite:///tickets.db)")
+
+    for name, help_text, path_help in (
+        ("export", "Exporter des serveurs dans un fichier (COPY binaire)", "Fichier de sortie"),
+        ("import", "Importer un fichier d'export (idempotent). Les statistiques d'un serveur déjà "
+                   "chargé par un bot en marche (ou présent dans son instantané) sont écrasées au "
+                   "prochain enregistrement: importer ces serveurs bot arrêté, sans instantané",
+         "Fichier à importer")
+    ):
+        transfer_parser = commands_parser.add_parser(name, help=help_text, description=help_text)
+        transfer_parser.add_argument("path", help=path_help)
+        transfer_parser.add_argument("--guild", type=int, action="append", dest="guild_ids",
+                                     help="ID de serveur (répétable, tous les serveurs par défaut)")
+        transfer_parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"),
+                                     help="URL de la base (par défaut: DATABASE_URL)")
+
+    args = parser.parse_args()
+    if args.command == "migrate":
+        asyncio.run(migrate(args.source, args.target))
+    else:
+        if not args.database_url:
+            parser.error("DATABASE_URL manquant (variable d'environnement ou --database-url)")
+        if args.command == "export":
+            asyncio.run(export_to_file(args.database_url, args.path, args.guild_ids))
+        else:
+            asyncio.run(import_from_file(args.database_url, args.path, args.guild_ids))
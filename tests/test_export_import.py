@@ -0,0 +1,116 @@
+import asyncio
+import io
+import struct
+
+import pytest
+
+from storage import (
+    EXPORT_MAGIC, EXPORT_TABLES, PGCOPY_SIGNATURE, SQLiteStorage,
+    _decode_copy_rows, _encode_copy_rows
+)
+
+
+def test_copy_encoding_matches_postgres_binary_layout():
+    # En-tête, une ligne (int8, text NULL, timestamp du 2000-01-02 UTC), puis le marqueur de fin
+    data = _encode_copy_rows(["guild_id", "data", "created_at"], [(1, None, 946684800 + 86400)])
+    expected = (
+        PGCOPY_SIGNATURE + struct.pack(">ii", 0, 0)
+        + struct.pack(">h", 3)
+        + struct.pack(">i", 8) + struct.pack(">q", 1)
+        + struct.pack(">i", -1)
+        + struct.pack(">i", 8) + struct.pack(">q", 86400 * 1000000)
+        + struct.pack(">h", -1)
+    )
+    assert data == expected
+
+
+def test_copy_rows_round_trip():
+    columns = ["guild_id", "category_name", "staff_role_id", "ticket_message",
+               "status_channel_id", "inactivity_timeout_hours", "created_at"]
+    rows = [
+        (1, "TICKETS", 123456789012345678, "{user} héllo 🎫", None, 48, 1_700_000_000),
+        (2, "", None, "", -5, None, None),
+    ]
+    assert _decode_copy_rows(columns, _encode_copy_rows(columns, rows)) == rows
+
+
+def test_copy_decoding_rejects_truncated_stream():
+    data = _encode_copy_rows(["guild_id"], [(1,)])
+    with pytest.raises(ValueError):
+        _decode_copy_rows(["guild_id"], data[:-3])
+
+
+async def fill(storage):
+    for guild_id in (1, 2):
+        await storage.update_server_config(guild_id, {"staff_role_id": guild_id * 10, "inactivity_timeout_hours": 3})
+        await storage.add_ticket_message(guild_id, guild_id * 100, guild_id * 1000)
+        await storage.record_ticket_opened(guild_id + 10, guild_id * 2000, guild_id, guild_id * 3000, now=1_700_000_000)
+        await storage.save_status_message(guild_id, guild_id * 400, guild_id * 4000)
+        await storage.save_ticket_stats({guild_id: '{"open_count": 1}'}, now=1_700_000_000)
+
+
+async def dump(storage, guild_id):
+    return {
+        table: [row for row in await storage.fetch_table(table) if row["guild_id"] == guild_id]
+        for table in EXPORT_TABLES
+    }
+
+
+def test_sqlite_export_import_round_trip_is_idempotent(tmp_path):
+    async def main():
+        source = SQLiteStorage(str(tmp_path / "source.db"))
+        target = SQLiteStorage(str(tmp_path / "target.db"))
+        await source.init()
+        await target.init()
+        try:
+            await fill(source)
+            output = io.BytesIO()
+            exported = await source.export_guilds(output)
+
+            # Import limité au serveur 1, deux fois: la seconde fois remplace sans dupliquer
+            counts = []
+            for _ in range(2):
+                counts.append(await target.import_guilds(io.BytesIO(output.getvalue()), [1]))
+
+            return exported, counts, await dump(source, 1), await dump(target, 1), await dump(target, 2)
+        finally:
+            await source.close()
+            await target.close()
+
+    exported, counts, source_rows, target_rows, other_guild = asyncio.run(main())
+    assert all(count == 2 for count in exported.values())
+    assert counts[0] == counts[1] == {table: 1 for table in EXPORT_TABLES}
+    assert target_rows == source_rows
+    assert all(rows == [] for rows in other_guild.values())
+
+
+def test_import_rejects_foreign_and_truncated_files(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "tickets.db"))
+        await storage.init()
+        try:
+            await fill(storage)
+            output = io.BytesIO()
+            await storage.export_guilds(output, [1])
+            with pytest.raises(ValueError):
+                await storage.import_guilds(io.BytesIO(b"not an export"))
+            with pytest.raises(ValueError):
+                await storage.import_guilds(io.BytesIO(output.getvalue()[:-6]))
+        finally:
+            await storage.close()
+
+    asyncio.run(main())
+
+
+def test_export_starts_with_magic(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "tickets.db"))
+        await storage.init()
+        try:
+            output = io.BytesIO()
+            await storage.export_guilds(output, [])
+            return output.getvalue()
+        finally:
+            await storage.close()
+
+    assert asyncio.run(main()).startswith(EXPORT_MAGIC)
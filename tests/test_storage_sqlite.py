@@ -0,0 +1,114 @@
+import asyncio
+
+from storage import SQLiteStorage, DEFAULT_TICKET_MESSAGE, TABLES, create_storage, migrate
+
+
+def run_with_storage(tmp_path, scenario, name="tickets.db"):
+    """Exécuter `scenario(storage)` sur une base SQLite fraîche"""
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / name))
+        await storage.init()
+        try:
+            return await scenario(storage)
+        finally:
+            await storage.close()
+    return asyncio.run(main())
+
+
+def test_create_storage_selects_backend():
+    assert isinstance(create_storage("sqlite:///tickets.db"), SQLiteStorage)
+    assert create_storage("sqlite:///tickets.db").path == "tickets.db"
+    assert create_storage("sqlite:////data/tickets.db").path == "/data/tickets.db"
+
+
+def test_server_config_defaults_and_update(tmp_path):
+    async def scenario(storage):
+        default = await storage.get_server_config(1)
+        await storage.update_server_config(1, {"staff_role_id": 42, "inactivity_timeout_hours": 6, "unknown": 1})
+        return default, await storage.get_server_config(1)
+
+    default, updated = run_with_storage(tmp_path, scenario)
+    assert default["category_name"] == "TICKETS"
+    assert default["ticket_message"] == DEFAULT_TICKET_MESSAGE
+    assert updated["staff_role_id"] == 42
+    assert updated["inactivity_timeout_hours"] == 6
+
+
+def test_ticket_open_and_close_are_recorded_together(tmp_path):
+    async def scenario(storage):
+        await storage.record_ticket_opened(10, 100, 1, 1000, now=1_700_000_000)
+        opened = await storage.get_user_open_ticket(10, 1)
+        buttons = await storage.load_close_button_messages()
+        closed = await storage.record_ticket_closed(100)
+        return opened, buttons, closed, await storage.load_open_tickets(), await storage.load_close_button_messages()
+
+    opened, buttons, closed, tickets_after, buttons_after = run_with_storage(tmp_path, scenario)
+    assert opened == 100
+    assert buttons == {1000: {"channel_id": 100, "guild_id": 1}}
+    assert closed == {"user_id": 10, "guild_id": 1, "created_at": 1_700_000_000, "close_message_ids": [1000]}
+    assert tickets_after == {}
+    assert buttons_after == {}
+
+
+def test_closing_unknown_channel_returns_no_ticket(tmp_path):
+    async def scenario(storage):
+        return await storage.record_ticket_closed(999)
+
+    closed = run_with_storage(tmp_path, scenario)
+    assert closed["user_id"] is None
+    assert closed["close_message_ids"] == []
+
+
+def test_inactive_tickets_use_last_activity(tmp_path):
+    now = 1_700_000_000
+
+    async def scenario(storage):
+        await storage.update_server_config(1, {"inactivity_timeout_hours": 1})
+        await storage.record_ticket_opened(10, 100, 1, 1000, now=now - 7200)
+        await storage.record_ticket_opened(11, 101, 1, 1001, now=now - 7200)
+        # Serveur sans délai configuré: jamais fermé automatiquement
+        await storage.record_ticket_opened(12, 102, 2, 1002, now=now - 7200)
+        await storage.save_ticket_activity({101: now - 60})
+        return await storage.find_inactive_tickets(now, limit=10)
+
+    expired = run_with_storage(tmp_path, scenario)
+    assert [ticket["ticket_channel_id"] for ticket in expired] == [100]
+
+
+def test_stats_and_metadata_round_trip(tmp_path):
+    async def scenario(storage):
+        await storage.save_ticket_stats({1: '{"open_count": 1}'}, now=1)
+        await storage.save_ticket_stats({1: '{"open_count": 2}'}, now=2)
+        await storage.save_ticket_stats({2: "{}"}, now=2)
+        await storage.set_metadata("command_tree_hash", "abc")
+        return (await storage.load_ticket_stats(), await storage.load_ticket_stats([1, 3]),
+                await storage.load_ticket_stats([]), await storage.get_metadata("command_tree_hash"))
+
+    stats, filtered, empty, value = run_with_storage(tmp_path, scenario)
+    assert stats == {1: '{"open_count": 2}', 2: "{}"}
+    assert filtered == {1: '{"open_count": 2}'}
+    assert empty == {}
+    assert value == "abc"
+
+
+def test_migrate_copies_every_table(tmp_path):
+    source_url = f"sqlite:///{tmp_path / 'source.db'}"
+    target_url = f"sqlite:///{tmp_path / 'target.db'}"
+
+    async def fill(storage):
+        await storage.update_server_config(1, {"staff_role_id": 42})
+        await storage.add_ticket_message(1, 500, 50)
+        await storage.record_ticket_opened(10, 100, 1, 1000, now=1_700_000_000)
+        await storage.save_status_message(1, 600, 60)
+        await storage.save_ticket_stats({1: "{}"}, now=1)
+        await storage.set_metadata("key", "value")
+
+    async def dump(storage):
+        return {table: await storage.fetch_table(table) for table in TABLES}
+
+    run_with_storage(tmp_path, fill, "source.db")
+    asyncio.run(migrate(source_url, target_url))
+    # Une seconde migration remplace les lignes au lieu de les dupliquer
+    asyncio.run(migrate(source_url, target_url))
+
+    assert run_with_storage(tmp_path, dump, "target.db") == run_with_storage(tmp_path, dump, "source.db")